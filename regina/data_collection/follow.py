@@ -0,0 +1,190 @@
+"""continuous collection of the access log"""
+from os import path, stat, read, close, fsencode
+from time import monotonic, sleep
+from select import select
+from struct import Struct
+from signal import signal, SIGTERM, SIGINT
+import ctypes
+import ctypes.util
+
+from regina.data_collection.log_reader import LogReader
+from regina.data_collection.parse_log import parse_byte_ranges
+from regina.utility.utility import pdebug, warning, pmessage
+from regina.utility.globals import settings
+
+"""
+Follow the access log like tail -f and add new requests to the database as they are written
+"""
+
+# from <sys/inotify.h>
+IN_MODIFY       = 0x00000002
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_NONBLOCK     = 0x00000800
+IN_CLOEXEC      = 0x00080000
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+inotify_event = Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Wait until a file in the directory of the logfile changes whose name starts with the name of the logfile.
+    Watching the directory instead of the file also catches the rotation, eg access.log -> access.log.1
+    Uses the inotify functions of the libc through ctypes.
+    @raises OSError: if inotify is not available
+    """
+    def __init__(self, logfile_path: str):
+        self.directory, self.basename = path.split(path.abspath(logfile_path))
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None: raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"): raise OSError("libc does not support inotify")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: errno={errno}")
+        mask = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        if libc.inotify_add_watch(self.fd, fsencode(self.directory), mask) < 0:
+            errno = ctypes.get_errno()
+            close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for '{self.directory}': errno={errno}")
+        pdebug(f"InotifyWatcher: Watching '{self.directory}' for changes of '{self.basename}*'", lvl=2)
+
+    def _read_events(self) -> bool:
+        """
+        read all pending events
+        @returns whether an event concerns the logfile or one of its rotated files
+        """
+        changed = False
+        while True:
+            try:
+                buffer = read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            i = 0
+            while i < len(buffer):
+                _, _, _, name_length = inotify_event.unpack_from(buffer, i)
+                i += inotify_event.size
+                name = buffer[i:i+name_length].rstrip(b"\0").decode("utf-8", errors="replace")
+                i += name_length
+                if name.startswith(self.basename):
+                    changed = True
+
+    def wait(self, timeout: float) -> bool:
+        """
+        wait for a change of the logfile, at most timeout seconds
+        @returns whether the logfile changed
+        """
+        end = monotonic() + timeout
+        while (remaining := end - monotonic()) > 0:
+            readable, _, _ = select([self.fd], [], [], remaining)
+            if readable and self._read_events():
+                return True
+        return False
+
+    def close(self):
+        close(self.fd)
+
+
+class PollWatcher:
+    """
+    Check the size, modification time and inode of the logfile every timeout seconds.
+    Used when inotify is not available, eg on other platforms than linux or on network file systems.
+    """
+    def __init__(self, logfile_path: str):
+        self.logfile_path = logfile_path
+        self.last_stat = self._stat()
+
+    def _stat(self):
+        try:
+            st = stat(self.logfile_path)
+            return (st.st_ino, st.st_dev, st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    def wait(self, timeout: float) -> bool:
+        sleep(timeout)
+        st = self._stat()
+        changed = st != self.last_stat
+        self.last_stat = st
+        return changed
+
+    def close(self):
+        pass
+
+
+def get_watcher(logfile_path: str) -> InotifyWatcher|PollWatcher:
+    if settings["data-collection"]["follow_inotify"]:
+        try:
+            return InotifyWatcher(logfile_path)
+        except OSError as e:
+            warning(f"follow: inotify is not available, checking '{logfile_path}' every {settings['data-collection']['follow_interval']} seconds instead: {e}")
+    return PollWatcher(logfile_path)
+
+
+def follow(db, logfile_path: str):
+    """
+    Add the new lines of the logfile to the database until regina receives SIGINT or SIGTERM
+    New lines are collected at most follow_interval seconds after the logfile changed, all lines that were written
+    in the meantime are added in one micro-batch.
+    If log_checkpoint is enabled, the collection continues at the checkpoint, otherwise it starts at the end of the logfile.
+    Rotations are handled by the LogReader, as long as the rotated logfile stays in the same directory.
+    The checkpoint is committed together with the requests, so that they are not added again if regina is killed.
+    @raises ValueError: if none of the new lines could be parsed, see parse_byte_range
+    """
+    interval = settings["data-collection"]["follow_interval"]
+    store_checkpoint = settings["data-collection"]["log_checkpoint"]
+    if store_checkpoint:
+        checkpoint = db.get_log_checkpoint(logfile_path)
+    else:
+        # skip everything that is already in the logfile
+        log_reader = LogReader(logfile_path)
+        for _ in log_reader.segments(): pass
+        checkpoint = log_reader.get_checkpoint()
+
+    stop = False
+    def set_stop(signum, frame):
+        nonlocal stop
+        pdebug(f"follow: Received signal {signum}, stopping after the current micro-batch", lvl=1)
+        stop = True
+    previous_handlers = { signum: signal(signum, set_stop) for signum in [SIGINT, SIGTERM] }
+
+    watcher = get_watcher(logfile_path)
+    pmessage(f"Following '{logfile_path}', new requests are added at most {interval} seconds after they were logged")
+    total_request_count = 0
+    last_collect = 0.0
+    changed = True  # collect what was written since the checkpoint
+    try:
+        while not stop:
+            if changed:
+                # collect all lines that are written until the interval is over in one micro-batch
+                wait_time = last_collect + interval - monotonic()
+                if wait_time > 0: sleep(wait_time)
+                last_collect = monotonic()
+                log_reader = LogReader(logfile_path, checkpoint)
+                try:
+                    byte_ranges = log_reader.byte_ranges()
+                    # the checkpoint after each byte range is stored with its requests, so that the lines are not added again after a crash
+                    log_checkpoints = ((logfile_path, checkpoint_) for _, checkpoint_ in byte_ranges) if store_checkpoint else None
+                    request_count, visitors_count, new_visitors_count = db.add_request_batches(parse_byte_ranges([ byte_range for byte_range, _ in byte_ranges ], jobs=1),
+                                                                                               log_checkpoints=log_checkpoints)
+                except FileNotFoundError:
+                    # during the rotation, the logfile might not exist for a moment
+                    pdebug(f"follow: '{logfile_path}' does not exist, waiting for it to be created", lvl=1)
+                    changed = watcher.wait(interval)
+                    continue
+                checkpoint = log_reader.get_checkpoint()
+                # also when there were no new lines, eg after a rotation
+                if store_checkpoint:
+                    db.set_log_checkpoint(logfile_path, checkpoint)
+                if request_count > 0:
+                    total_request_count += request_count
+                    pdebug(f"follow: + {request_count} new requests, {visitors_count} visitors, {new_visitors_count} new visitors", lvl=1)
+            changed = watcher.wait(interval)
+    finally:
+        watcher.close()
+        for signum, handler in previous_handlers.items():
+            signal(signum, handler)
+    return total_request_count
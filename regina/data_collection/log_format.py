@@ -0,0 +1,124 @@
+"""nginx log_format parsing"""
+from re import compile as re_compile, escape, findall, split
+from operator import itemgetter
+
+"""
+Compile the log_format from the nginx configuration into a parser for the lines of the access log
+"""
+
+# nginx' predefined format
+log_format_combined = '$remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"'
+
+# variables that are used for the Request, in the order of LogFormat.get_request_values
+request_variables = ["remote_addr", "time_local", "request", "request_method", "request_uri", "server_protocol", "status", "body_bytes_sent", "http_referer", "http_user_agent"]
+# variables that are neither used for the Request nor stored as extra values
+ignored_variables = ["remote_user"]
+# variables that nginx always logs as a decimal number, lines with other values do not match
+numeric_variables = ["status", "body_bytes_sent", "bytes_sent", "request_length", "connection", "connection_requests", "pid"]
+
+# $variable or ${variable}
+re_variable = r"\$(?:\{(\w+)\}|(\w+))"
+
+
+def unquote_log_format(log_format: str) -> str:
+    """
+    allow the log_format to be copied from the nginx configuration, where it can consist of multiple quoted strings:
+        '$remote_addr - $remote_user [$time_local] '
+        '"$request" $status ...';
+    """
+    log_format = log_format.strip().rstrip(";").strip()
+    if log_format == "combined":
+        return log_format_combined
+    if log_format and log_format[0] in "'\"":
+        quote = log_format[0]
+        return "".join(findall(f"{quote}([^{quote}]*){quote}", log_format))
+    return log_format
+
+
+class LogFormat:
+    """
+    Parser for the lines of an access log that was written with an nginx log_format.
+
+    Each variable contains everything up to the literal text that follows it, numeric_variables have to be decimal numbers.
+    Text after the last literal is ignored, so that lines with additional fields at the end still match.
+    If there is literal text between all variables, the line is split with str.partition, which is faster than a regex.
+    If that fails, eg because a quoted value contains the following literal, or if there is no literal between some variables, a regex is used.
+    """
+    def __init__(self, log_format: str):
+        self.source = log_format
+        self.log_format = unquote_log_format(log_format)
+        parts = split(re_variable, self.log_format)
+        # parts = [literal, braced_name, name, literal, ..., literal]
+        self.literals: list[str] = parts[0::3]
+        self.variables: list[str] = [ braced or name for braced, name in zip(parts[1::3], parts[2::3]) ]
+        if not self.variables:
+            raise ValueError(f"log_format does not contain any variables: '{self.log_format}'")
+        for required in ["remote_addr", "time_local"]:
+            if required not in self.variables:
+                raise ValueError(f"log_format does not contain the required variable ${required}: '{self.log_format}'")
+        if "request" not in self.variables and "request_uri" not in self.variables:
+            raise ValueError(f"log_format does not contain the required variable $request or $request_uri: '{self.log_format}'")
+
+        self.prefix = self.literals[0]
+        self.separators = self.literals[1:-1]
+        self.suffix = self.literals[-1]
+        self.use_split = all(self.separators)
+        self.numeric_indices = [ i for i, v in enumerate(self.variables) if v in numeric_variables ]
+        # non greedy, so that each variable ends at the first occurence of the following literal
+        groups = [ r"(\d+)" if v in numeric_variables else "(.*?)" for v in self.variables ]
+        # without a suffix, the last variable contains the rest of the line
+        if not self.suffix and groups[-1] == "(.*?)": groups[-1] = "(.*)"
+        self.regex = re_compile("".join(escape(literal) + group for literal, group in zip(self.literals, groups)) + escape(self.suffix))
+
+        # variables that are not in the log_format get the value of the "" that is appended in get_request_values
+        missing = len(self.variables)
+        self.request_getter = itemgetter(*(self.variables.index(v) if v in self.variables else missing for v in request_variables))
+        self.has_all_request_variables = all(v in self.variables for v in request_variables)
+        self.extra_variables = [ (i, v) for i, v in enumerate(self.variables) if v not in request_variables and v not in ignored_variables ]
+
+    def _split_at_literals(self, line: str) -> list[str]|None:
+        if not line.startswith(self.prefix): return None
+        rest = line[len(self.prefix):]
+        values = []
+        for separator in self.separators:
+            value, found, rest = rest.partition(separator)
+            if not found: return None
+            values.append(value)
+        if self.suffix:
+            rest, found, _ = rest.partition(self.suffix)
+            if not found: return None
+        values.append(rest)
+        for i in self.numeric_indices:
+            if not (values[i].isascii() and values[i].isdigit()): return None
+        return values
+
+    def split(self, line: str) -> list[str]|None:
+        """
+        @returns the values of all variables in the order in which they appear in the log_format, None if the line does not match
+        """
+        if self.use_split:
+            values = self._split_at_literals(line)
+            if values is not None: return values
+        m = self.regex.match(line)
+        if m is None: return None
+        return list(m.groups())
+
+    def get_request_values(self, values: list[str]) -> tuple[str, ...]:
+        """
+        @param values: from split
+        @returns the values of the request_variables, "" for variables that are not in the log_format
+        """
+        if not self.has_all_request_variables:
+            values = values + [""]
+        return self.request_getter(values)
+
+    def get_extra_values(self, values: list[str]) -> dict[str, str]|None:
+        """
+        @param values: from split
+        @returns { variable: value } for all variables that are not used for the Request, None if there are none
+        """
+        if not self.extra_variables: return None
+        return { v: values[i] for i, v in self.extra_variables }
+
+    def __repr__(self):
+        return f"LogFormat('{self.log_format}', variables={self.variables}, use_split={self.use_split})"
@@ -0,0 +1,156 @@
+"""incremental reading of logfiles"""
+from os import path, listdir, stat, stat_result
+from hashlib import sha1
+from typing import BinaryIO, Generator
+
+from regina.data_collection.parse_log import iter_lines, split_byte_range
+from regina.utility.utility import pdebug, warning
+
+"""
+A checkpoint stores how far a logfile has been read: (inode, device, offset, last_line_hash)
+"""
+
+# number of bytes before the offset that are used to verify the checkpoint
+last_line_max_size = 4096
+
+def hash_line(line: bytes) -> str:
+    return sha1(line[-last_line_max_size:]).hexdigest()
+
+def get_last_line_hash(file: BinaryIO, offset: int) -> str:
+    """
+    get the hash of the line that ends at offset (offset points to the byte after the newline)
+    """
+    if offset == 0: return ""
+    start = max(0, offset - last_line_max_size - 1)
+    file.seek(start)
+    window = file.read(offset - start)
+    if not window.endswith(b"\n"): return ""
+    line = window[:-1]
+    if start > 0 or b"\n" in line:
+        line = line.rsplit(b"\n", 1)[-1]
+    return hash_line(line)
+
+def get_last_line_end(file: BinaryIO, size: int) -> int:
+    """
+    get the offset after the last newline in the first size bytes of file, 0 if there is none
+    """
+    end = size
+    while end > 0:
+        start = max(0, end - last_line_max_size)
+        file.seek(start)
+        i = file.read(end - start).rfind(b"\n")
+        if i >= 0: return start + i + 1
+        end = start
+    return 0
+
+
+class LogReader:
+    """
+    Read the lines of a logfile, starting where the previous run stopped.
+
+    If the logfile was rotated since the last checkpoint (the inode changed), the rest of the rotated file
+    is read first. It needs to be in the same directory and start with the name of the logfile, eg access.log.1
+    If the logfile was truncated or its content changed, it is read from the start.
+    Only complete lines are read, an incomplete last line will be read in the next run.
+    """
+    def __init__(self, logfile_path: str, checkpoint: tuple[int, int, int, str]|None=None):
+        self.logfile_path = logfile_path
+        self.checkpoint = checkpoint
+        self.inode = 0
+        self.device = 0
+        self.offset = 0
+        self.last_line_hash = ""
+
+    def _is_valid_checkpoint(self, file: BinaryIO, st: stat_result) -> bool:
+        assert(self.checkpoint is not None)
+        inode, device, offset, last_line_hash = self.checkpoint
+        if st.st_ino != inode or st.st_dev != device: return False
+        if st.st_size < offset:
+            pdebug(f"LogReader: '{file.name}' was truncated: size={st.st_size}, offset={offset}", lvl=1)
+            return False
+        if get_last_line_hash(file, offset) != last_line_hash:
+            pdebug(f"LogReader: '{file.name}' changed: line before offset={offset} does not match checkpoint", lvl=1)
+            return False
+        return True
+
+    def _find_rotated_logfile(self) -> str|None:
+        """find the file in the logfile directory that has the inode of the checkpoint"""
+        assert(self.checkpoint is not None)
+        inode, device, _, _ = self.checkpoint
+        directory, basename = path.split(path.abspath(self.logfile_path))
+        for filename in sorted(listdir(directory)):
+            if not filename.startswith(basename) or filename == basename: continue
+            try:
+                st = stat(path.join(directory, filename))
+            except OSError:
+                continue
+            if st.st_ino == inode and st.st_dev == device:
+                return path.join(directory, filename)
+        return None
+
+    def _segment_from(self, file: BinaryIO, st: stat_result, offset: int) -> tuple[str, int, int]:
+        """
+        get the segment from offset to the end of the last complete line and move the checkpoint there
+        """
+        end = get_last_line_end(file, st.st_size)
+        if end < offset: end = offset
+        self.inode, self.device, self.offset = st.st_ino, st.st_dev, end
+        self.last_line_hash = get_last_line_hash(file, end)
+        return (file.name, offset, end)
+
+    def segments(self) -> Generator[tuple[str, int, int], None, None]:
+        """
+        yield all parts of logfiles that come after the checkpoint as (path, start, end) byte ranges
+        each range ends after the newline of the last complete line
+        """
+        with open(self.logfile_path, "rb") as file:
+            st = stat(file.fileno())
+            if self.checkpoint is None:
+                pdebug(f"LogReader: No checkpoint for '{self.logfile_path}', reading from the start", lvl=1)
+                yield self._segment_from(file, st, 0)
+            elif self._is_valid_checkpoint(file, st):
+                pdebug(f"LogReader: Continuing '{self.logfile_path}' at offset={self.checkpoint[2]}", lvl=1)
+                yield self._segment_from(file, st, self.checkpoint[2])
+            else:
+                if st.st_ino != self.checkpoint[0] or st.st_dev != self.checkpoint[1]:
+                    rotated_path = self._find_rotated_logfile()
+                    if rotated_path is None:
+                        warning(f"LogReader: '{self.logfile_path}' was rotated, but the rotated file could not be found. Requests logged before the rotation might be missing.")
+                    else:
+                        with open(rotated_path, "rb") as rotated_file:
+                            rotated_st = stat(rotated_file.fileno())
+                            if self._is_valid_checkpoint(rotated_file, rotated_st):
+                                pdebug(f"LogReader: '{self.logfile_path}' was rotated, finishing '{rotated_path}' at offset={self.checkpoint[2]}", lvl=1)
+                                yield self._segment_from(rotated_file, rotated_st, self.checkpoint[2])
+                            else:
+                                warning(f"LogReader: Rotated logfile '{rotated_path}' does not match the checkpoint, skipping it.")
+                yield self._segment_from(file, st, 0)
+
+    def lines(self) -> Generator[bytes, None, None]:
+        """
+        yield all lines after the checkpoint, without the trailing newline
+        """
+        for logfile_path, start, end in self.segments():
+            with open(logfile_path, "rb") as file:
+                file.seek(start)
+                yield from iter_lines(file, max_bytes=end - start)
+
+    def byte_ranges(self) -> list[tuple[tuple[str, int, int], tuple[int, int, int, str]]]:
+        """
+        split all parts of logfiles that come after the checkpoint into byte ranges, see split_byte_range
+        @returns [ ((logfile_path, start, end), checkpoint after the byte range) ]
+        """
+        byte_ranges = []
+        for logfile_path, start, end in self.segments():
+            with open(logfile_path, "rb") as file:
+                st = stat(file.fileno())
+                for start_, end_ in split_byte_range(file, start, end):
+                    byte_ranges.append(((logfile_path, start_, end_), (st.st_ino, st.st_dev, end_, get_last_line_hash(file, end_))))
+        return byte_ranges
+
+    def get_checkpoint(self) -> tuple[int, int, int, str]:
+        """
+        get the checkpoint after the last segment that was yielded by segments() or lines()
+        the segment only counts as read once all of its lines were consumed, so only store the checkpoint after that
+        """
+        return (self.inode, self.device, self.offset, self.last_line_hash)
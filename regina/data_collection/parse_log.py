@@ -1,44 +1,303 @@
+"""log parsing"""
 from re import fullmatch, match
-from regina.data_collection.request import Request
+from collections import deque
+from itertools import pairwise
+from glob import glob, has_magic
+from os import path
+from bisect import bisect_left
+from math import inf
+from typing import BinaryIO, Generator, Iterable
+import gzip
+import bz2
+import lzma
+from regina.data_collection.request import Request, RequestBatch, parse_time_local
+from regina.data_collection.log_format import LogFormat
 from regina.utility.utility import pdebug, warning, pmessage
+from regina.utility.globals import settings, init_worker_settings
 
 """
 collect information from the access log and put it into the database
 """
 
-re_remote_addr = r"[0-9a-fA-F.:]+"
-re_remote_user = ".*"
-re_time_local = r"\[.+\]"
-re_request = r'"[^"]*"'
-re_status = r'\d+'
-re_body_bytes_sent = r'\d+'
-re_http_referer = r'"([^"]*)"'
-re_http_user_agent = r'"([^"]*)"'
-re_log_format: str = f'({re_remote_addr}) - ({re_remote_user}) ({re_time_local}) ({re_request}) ({re_status}) ({re_body_bytes_sent}) {re_http_referer} {re_http_user_agent}'
-
-def parse_log(logfile_path:str) -> list[Request]:
-    """
-    create Request objects from each line in the logfile
-    """
-    requests = []
-    with open(logfile_path, "r") as file:
-        lines = file.readlines()
-    for i in range(len(lines)):
-        m = match(re_log_format, lines[i])
-        if m is None:
-            line = lines[i].strip('\n')
-            warning(f"parse_log: Could not match line {i:3}: '{line}'")
-            continue
-        pdebug(f"parse_log: line {i:3} match groups:", m.groups(), lvl=4)
-        # _ is user
-        ip_address, _, timestamp, request_, status, bytes_sent, referer, user_agent = m.groups()
+# compiled log_format from the settings, see get_log_format
+log_format: LogFormat|None = None
+
+# number of bytes that are read from the logfile at once
+read_chunk_size = 1024 * 1024
+
+def iter_lines(file: BinaryIO, chunk_size=read_chunk_size, yield_incomplete=True, max_bytes: int|None=None) -> Generator[bytes, None, None]:
+    """
+    yield the lines of a file opened in binary mode, without the trailing newline
+    at most chunk_size bytes (+ the length of one line) are held in memory at once
+    @param yield_incomplete: whether to yield the last line if it does not end with a newline
+    @param max_bytes: stop after reading this many bytes from the current position
+    """
+    rest = b""
+    while True:
+        if max_bytes is None:
+            chunk = file.read(chunk_size)
+        else:
+            chunk = file.read(min(chunk_size, max_bytes))
+            max_bytes -= len(chunk)
+        if not chunk: break
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()  # incomplete line, continued in next chunk
+        yield from lines
+    if rest and yield_incomplete:
+        yield rest
+
+# magic bytes at the start of compressed files and the function that opens them
+compression_formats = {
+    "gzip": (b"\x1f\x8b", gzip.open),
+    "bzip2": (b"BZh", bz2.open),
+    "xz": (b"\xfd7zXZ\x00", lzma.open),
+}
+
+def get_compression(logfile_path: str) -> str|None:
+    """
+    detect the compression of a file by its first bytes, the file extension is ignored
+    @returns the name of the compression format, None if the file is not compressed
+    """
+    with open(logfile_path, "rb") as file:
+        head = file.read(6)
+    for compression, (magic, _) in compression_formats.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def open_logfile(logfile_path: str) -> BinaryIO:
+    """
+    open a logfile in binary mode, compressed files are decompressed while they are read
+    """
+    compression = get_compression(logfile_path)
+    if compression is None:
+        return open(logfile_path, "rb")
+    pdebug(f"open_logfile: '{logfile_path}' is {compression} compressed", lvl=2)
+    return compression_formats[compression][1](logfile_path, "rb")
+
+def get_logfile_paths(patterns: Iterable[str]) -> list[str]:
+    """
+    expand glob patterns, each file is only returned once
+    @raises FileNotFoundError: if a pattern does not match any file
+    """
+    logfile_paths = {}
+    for pattern in patterns:
+        if has_magic(pattern):
+            matches = sorted(p for p in glob(pattern) if path.isfile(p))
+        else:
+            matches = [pattern] if path.isfile(pattern) else []
+        if not matches:
+            raise FileNotFoundError(f"No logfile matches '{pattern}'")
+        for logfile_path in matches:
+            logfile_paths[path.abspath(logfile_path)] = logfile_path
+    return list(logfile_paths.values())
+
+def get_log_format() -> LogFormat:
+    """
+    get the compiled log_format from the settings
+    it is only compiled again when the setting changes
+    """
+    global log_format
+    if log_format is None or log_format.source != settings["regina"]["log_format"]:
+        log_format = LogFormat(settings["regina"]["log_format"])
+        pdebug(f"get_log_format: {log_format}", lvl=2)
+    return log_format
+
+def parse_line(line: str, line_nr: int=0) -> Request|None:
+    """
+    create a Request from a single line of the logfile
+    returns None if the line could not be parsed
+    """
+    log_format = get_log_format()
+    values = log_format.split(line)
+    if values is None:
+        warning(f"parse_log: Could not match line {line_nr:3}: '{line}'")
+        return None
+    pdebug(f"parse_log: line {line_nr:3} values:", values, lvl=4)
+    ip_address, timestamp, request_, http_function, route, protocol, status, bytes_sent, referer, user_agent = log_format.get_request_values(values)
+    if request_:
         request_parts = request_.split(" ")
         if len(request_parts) != 3:
-            warning(f"parse_log: Could not parse request of line {i:3}: '{request_}'")
-            continue
+            warning(f"parse_log: Could not parse request of line {line_nr:3}: '{request_}'")
+            return None
         http_function, route, protocol = request_parts
-        requests.append(Request(ip_address=ip_address, time_local=timestamp,
-                                request_type=http_function, request_route=route, request_protocol=protocol,
-                                status=status, bytes_sent=bytes_sent, referer=referer, user_agent=user_agent))
-    return requests
+    status = status or "0"
+    bytes_sent = bytes_sent or "0"
+    # they are stored as int16 and int64 in the RequestBatch
+    if not (status.isascii() and status.isdigit() and len(status) <= 3 and bytes_sent.isascii() and bytes_sent.isdigit() and len(bytes_sent) <= 18):
+        warning(f"parse_log: Invalid status or body_bytes_sent in line {line_nr:3}: status='{status}', body_bytes_sent='{bytes_sent}'")
+        return None
+    return Request(ip_address=ip_address, time_local=timestamp,
+                   request_type=http_function, request_route=route, request_protocol=protocol,
+                   status=status, bytes_sent=bytes_sent, referer=referer, user_agent=user_agent,
+                   extra=log_format.get_extra_values(values))
+
+def parse_lines(lines) -> Generator[Request, None, None]:
+    """
+    lazily create Request objects from an iterable of lines (bytes or str)
+    lines that can not be parsed are skipped
+    """
+    for i, line in enumerate(lines):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        request = parse_line(line.rstrip("\r\n"), i)
+        if request is not None:
+            yield request
+
+def parse_log(logfile_path:str) -> Generator[Request, None, None]:
+    """
+    lazily create Request objects from each line in the logfile
+    the file is read in chunks, so that the memory usage does not depend on the size of the logfile
+    """
+    with open_logfile(logfile_path) as file:
+        yield from parse_lines(iter_lines(file))
+
+def get_first_timestamp(logfile_path: str) -> int|None:
+    """
+    get the time of the first line of a logfile that matches the log_format
+    @returns unix time, None if no line matches
+    """
+    log_format = get_log_format()
+    with open_logfile(logfile_path) as file:
+        for line in iter_lines(file, chunk_size=64 * 1024):
+            values = log_format.split(line.decode("utf-8", errors="replace").rstrip("\r"))
+            if values is not None:
+                return parse_time_local(log_format.get_request_values(values)[1])
+    return None
+
+
+# size of the byte ranges that are parsed by a worker process at once
+parse_range_size = 4 * 1024 * 1024
+
+def split_byte_range(file: BinaryIO, start: int, end: int, range_size: int=parse_range_size) -> list[tuple[int, int]]:
+    """
+    split the byte range [start, end) of file into ranges of about range_size bytes
+    all ranges except the first start at the beginning of a line
+    """
+    ranges = []
+    while end - start > range_size:
+        file.seek(start + range_size)
+        file.readline()
+        split = file.tell()
+        if split >= end: break
+        ranges.append((start, split))
+        start = split
+    if start < end:
+        ranges.append((start, end))
+    return ranges
+
+# a byte range with at least this many lines of which none match the log_format is an error, see parse_byte_range
+unmatched_range_min_lines = 10
+
+def parse_byte_range(byte_range: tuple[str, int, int|None]) -> RequestBatch:
+    """
+    parse the lines of a byte range (logfile_path, start, end) of a logfile
+    if end is None, the file is parsed until its end. This is used for compressed files, which can not be split.
+    @raises ValueError: if none of at least unmatched_range_min_lines lines match the log_format.
+        The log_format is most likely wrong then, and the requests would be lost if the log_checkpoint moved past them.
+    """
+    logfile_path, start, end = byte_range
+    line_count = 0
+    def count_lines(lines):
+        nonlocal line_count
+        for line in lines:
+            line_count += 1
+            yield line
+    with open_logfile(logfile_path) as file:
+        if start: file.seek(start)
+        batch = RequestBatch(parse_lines(count_lines(iter_lines(file, max_bytes=None if end is None else end - start))))
+    if len(batch) == 0 and line_count >= unmatched_range_min_lines:
+        raise ValueError(f"None of the {line_count} lines in bytes {start}-{'' if end is None else end} of '{logfile_path}' could be parsed, check the log_format")
+    return batch
+
+def parse_byte_ranges(byte_ranges: list[tuple[str, int, int|None]], jobs: int) -> Generator[RequestBatch, None, None]:
+    """
+    lazily create a RequestBatch for each byte range, see parse_byte_range
+    if jobs > 1, the ranges are parsed by jobs worker processes.
+    The batches are yielded in the order of byte_ranges.
+    @raises ValueError: if none of the lines of a byte range could be parsed, see parse_byte_range
+    """
+    if jobs <= 1:
+        for byte_range in byte_ranges:
+            yield parse_byte_range(byte_range)
+        return
+    pdebug(f"parse_byte_ranges: Parsing {len(byte_ranges)} byte ranges with {jobs} processes", lvl=2)
+    # imported here, because it is only needed with multiple jobs
+    from multiprocessing import Pool
+    # the workers need the log_format from the loaded settings
+    with Pool(jobs, initializer=init_worker_settings, initargs=(settings,)) as pool:
+        # only keep a few results in memory if adding the requests to the database is slower than parsing them
+        pending = deque()
+        for byte_range in byte_ranges:
+            pending.append(pool.apply_async(parse_byte_range, (byte_range,)))
+            if len(pending) > 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+def merge_request_batches(batches: Iterable[tuple[RequestBatch, float]]) -> Generator[RequestBatch, None, None]:
+    """
+    sort the requests from multiple logfiles by their timestamp
+    @param batches: (batch, cutoff), where all requests in the following batches are at or after cutoff
+    Requests are held back until no earlier request can follow, so only the requests in the time range where
+    logfiles overlap need to be kept in memory.
+    """
+    buffer = RequestBatch()
+    for batch, cutoff in batches:
+        buffer.extend_batch(batch)
+        times = buffer.time_local
+        if all(a <= b for a, b in pairwise(times)):
+            order = range(len(buffer))
+        else:
+            order = sorted(range(len(buffer)), key=times.__getitem__)
+        ready = bisect_left(order, cutoff, key=times.__getitem__)
+        if ready == 0: continue
+        if ready == len(buffer) and isinstance(order, range):
+            yield buffer
+            buffer = RequestBatch()
+            continue
+        yield buffer.select(order[:ready])
+        buffer = buffer.select(order[ready:])
+    if len(buffer) > 0:
+        yield buffer
+
+def parse_logfiles(logfile_paths: list[str], jobs: int=1) -> Generator[RequestBatch, None, None]:
+    """
+    lazily create RequestBatches from multiple logfiles, which may be compressed with gzip, bzip2 or xz
+    the logfiles are parsed by jobs worker processes and the requests are yielded in timestamp order.
+    Uncompressed logfiles are split into byte ranges, compressed logfiles are parsed by a single process each.
+    """
+    logfiles = []
+    for logfile_path in logfile_paths:
+        first_timestamp = get_first_timestamp(logfile_path)
+        if first_timestamp is None:
+            warning(f"parse_logfiles: '{logfile_path}' does not contain any requests, skipping it.")
+            continue
+        logfiles.append((first_timestamp, logfile_path))
+    # rotated logfiles usually do not overlap, so that the merge only has to reorder few requests
+    logfiles.sort()
+    byte_ranges = []
+    # (first timestamp of the next logfile, whether the byte range is the last of its logfile)
+    next_timestamps = []
+    for i, (_, logfile_path) in enumerate(logfiles):
+        next_timestamp = logfiles[i+1][0] if i + 1 < len(logfiles) else inf
+        if get_compression(logfile_path) is None:
+            with open(logfile_path, "rb") as file:
+                ranges = [ (logfile_path, start, end) for start, end in split_byte_range(file, 0, path.getsize(logfile_path)) ]
+        else:
+            ranges = [ (logfile_path, 0, None) ]
+        byte_ranges += ranges
+        next_timestamps += [ (next_timestamp, j == len(ranges) - 1) for j in range(len(ranges)) ]
+    pdebug(f"parse_logfiles: Parsing {len(logfiles)} logfiles in {len(byte_ranges)} byte ranges", lvl=2)
 
+    def get_cutoffs():
+        last_timestamp = -inf
+        for batch, (next_timestamp, is_last) in zip(parse_byte_ranges(byte_ranges, jobs), next_timestamps):
+            if len(batch) > 0: last_timestamp = batch.time_local[-1]
+            if is_last:
+                last_timestamp = -inf
+            else:
+                # the rest of the logfile is assumed to continue after its last request
+                next_timestamp = min(next_timestamp, last_timestamp)
+            yield batch, next_timestamp
+    yield from merge_request_batches(get_cutoffs())
@@ -1,33 +1,84 @@
 from ipaddress import IPv4Address, ip_address
 from time import mktime
+from calendar import timegm
+from array import array
+from sys import intern
+from typing import Iterable, Iterator
 from re import fullmatch, match
 from datetime import datetime as dt
 
 from regina.utility.sql_util import sanitize, sql_select, sql_exists, sql_insert, sql_tablesize, sql_max
 from regina.utility.utility import pdebug, warning, pmessage
 from regina.utility.globals import user_agent_platforms, user_agent_browsers, settings
+from regina.data_collection.user_agent import get_platform, get_browser, get_mobile
 
 months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
-class Request:
-    def __init__(self, ip_address="", time_local="", request_type="", request_route="", request_protocol="", status="", bytes_sent="", referer="", user_agent=""):
-        self.ip_address = int(IPv4Address(sanitize(ip_address)))
-        self.time_local = 0
-        # turn [20/Nov/2022:00:47:36 +0100] to unix time
-        m =  match(r"\[(\d+)/(\w+)/(\d+):(\d+):(\d+):(\d+).*\]", time_local)
-        if m:
-            g = m.groups()
+month_numbers = { month: i+1 for i, month in enumerate(months) }
+
+# unix time of the minute of a time_local string, see parse_time_local
+time_cache: dict[str, int] = {}
+time_cache_max_size = 1000
+
+def parse_time_local(time_local: str) -> int:
+    """
+    turn the time_local string from the log, eg 20/Nov/2022:00:47:36 +0100, to unix time
+    nginx always uses the same width, so the fields are sliced out of the string.
+    The unix time of each minute is cached, so for most lines only the seconds have to be parsed.
+    If the time does not have the expected width, it is parsed with a regular expression.
+    The timezone offset is taken into account, if it is missing the time is assumed to be in the local timezone.
+    @returns unix time, 0 if the time could not be parsed
+    """
+    # dd/Mon/yyyy:HH:MM:SS +zzzz
+    if len(time_local) == 26 and time_local[17] == ":" and time_local[20] == " ":
+        key = time_local[0:17] + time_local[21:26]  # dd/Mon/yyyy:HH:MM+zzzz
+        minute = time_cache.get(key)
+        if minute is None:
             try:
-                if g[1] in months:
+                minute = timegm((int(time_local[7:11]), month_numbers[time_local[3:6]], int(time_local[0:2]), int(time_local[12:14]), int(time_local[15:17]), 0))
+                offset = int(time_local[22:24]) * 3600 + int(time_local[24:26]) * 60
+                if time_local[21] == "-": minute += offset
+                elif time_local[21] == "+": minute -= offset
+                else: raise ValueError(f"Invalid timezone offset: '{time_local[21:26]}'")
+            except (ValueError, KeyError):
+                return _parse_time_local_regex(time_local)
+            if len(time_cache) >= time_cache_max_size:
+                time_cache.clear()
+            time_cache[key] = minute
+        try:
+            return minute + int(time_local[18:20])
+        except ValueError:
+            pass
+    return _parse_time_local_regex(time_local)
+
+def _parse_time_local_regex(time_local: str) -> int:
+    time = 0
+    m =  match(r"\[?(\d+)/(\w+)/(\d+):(\d+):(\d+):(\d+)(?: ([+-])(\d\d):?(\d\d))?", time_local)
+    if m:
+        g = m.groups()
+        try:
+            if g[1] in months:
+                if g[6] is None:
                     datetime_ = dt(int(g[2]), months.index(g[1])+1, int(g[0]), int(g[3]), int(g[4]), int(g[5]))
-                    # pdebug(f"Request __init__: datetime {datetime_}, from {g}")
-                    self.time_local = int(mktime(datetime_.timetuple()))
+                    time = int(mktime(datetime_.timetuple()))
                 else:
-                    warning(f"Request:__init__: Unkown month: '{g[1]}'. Using timestamp {self.time_local}")
-            except Exception as e:
-                warning(f"Request:__init__: {e}")
-        else:
-            warning(f"Request:__init__: Could not match time: '{time_local}'")
+                    time = timegm((int(g[2]), months.index(g[1])+1, int(g[0]), int(g[3]), int(g[4]), int(g[5])))
+                    offset = int(g[7]) * 3600 + int(g[8]) * 60
+                    time += -offset if g[6] == "+" else offset
+            else:
+                warning(f"parse_time_local: Unkown month: '{g[1]}'. Using timestamp {time}")
+        except Exception as e:
+            warning(f"parse_time_local: {e}")
+    else:
+        warning(f"parse_time_local: Could not match time: '{time_local}'")
+    return time
+
+
+class Request:
+    __slots__ = ("ip_address", "time_local", "type", "route", "protocol", "status", "bytes_sent", "referer", "user_agent", "extra")
+    def __init__(self, ip_address="", time_local="", request_type="", request_route="", request_protocol="", status="", bytes_sent="", referer="", user_agent="", extra: dict[str, str]|None=None):
+        self.ip_address = int(IPv4Address(sanitize(ip_address)))
+        self.time_local = parse_time_local(time_local)
         self.type = sanitize(request_type)        # GET, POST, ...
         self.route = sanitize(request_route)      # eg. /index.html
         self.protocol = sanitize(request_protocol)    # eg. HTTP/1.1
@@ -35,28 +86,123 @@ class Request:
         self.bytes_sent = sanitize(bytes_sent)
         self.referer = sanitize(referer)
         self.user_agent = sanitize(user_agent)
+        self.extra = extra                        # values of variables from the log_format that are not used otherwise
+
+    @classmethod
+    def from_values(cls, ip_address: int, time_local: int, request_type: str, route: str, protocol: str, status: str, bytes_sent: str, referer: str, user_agent: str, extra: dict[str, str]|None=None):
+        """
+        create a Request from values that have already been parsed and sanitized, see values()
+        """
+        request = cls.__new__(cls)
+        request.ip_address = ip_address
+        request.time_local = time_local
+        request.type = request_type
+        request.route = route
+        request.protocol = protocol
+        request.status = status
+        request.bytes_sent = bytes_sent
+        request.referer = referer
+        request.user_agent = user_agent
+        request.extra = extra
+        return request
+
+    def values(self) -> tuple[int, int, str, str, str, str, str, str, str, dict[str, str]|None]:
+        return (self.ip_address, self.time_local, self.type, self.route, self.protocol, self.status, self.bytes_sent, self.referer, self.user_agent, self.extra)
 
     def __repr__(self):
         return f"{self.ip_address} - {self.time_local} - {self.route} - {self.user_agent} - {self.status}"
 
     def get_platform(self):
-        # for groups in findall(re_visitor_agent, visitor_agent):
-        operating_system = ""
-        for os in user_agent_platforms:
-            if os in self.user_agent:
-                operating_system = os
-                break
-        return operating_system
+        return get_platform(self.user_agent)
 
     def get_browser(self):
-        browser = ""
-        for br in user_agent_browsers:
-            if br in self.user_agent:
-                browser = br
-                break
-        return browser
+        return get_browser(self.user_agent)
 
     def get_mobile(self):
-        return "Mobi" in self.user_agent
+        return get_mobile(self.user_agent)
+
+
+class RequestBatch:
+    """
+    Many requests stored as parallel columns, which needs far less memory than a list of Request objects.
+    Numbers are stored in arrays, strings are interned so that repeated routes, referers and user agents are only stored once.
+    This is also the format in which requests are passed from the parser processes to the database.
+    """
+    __slots__ = Request.__slots__
+    def __init__(self, requests: Iterable[Request]=()):
+        self.ip_address = array("I")    # ipv4 address as uint32
+        self.time_local = array("q")    # unix time
+        self.type: list[str] = []
+        self.route: list[str] = []
+        self.protocol: list[str] = []
+        self.status = array("h")
+        self.bytes_sent = array("q")
+        self.referer: list[str] = []
+        self.user_agent: list[str] = []
+        self.extra: list[dict[str, str]|None] = []
+        self.extend(requests)
+
+    def __len__(self):
+        return len(self.time_local)
+
+    def append(self, request: Request):
+        self.ip_address.append(request.ip_address)
+        self.time_local.append(request.time_local)
+        self.type.append(intern(request.type))
+        self.route.append(intern(request.route))
+        self.protocol.append(intern(request.protocol))
+        self.status.append(int(request.status))
+        self.bytes_sent.append(int(request.bytes_sent))
+        self.referer.append(intern(request.referer))
+        self.user_agent.append(intern(request.user_agent))
+        self.extra.append(request.extra)
+
+    def extend(self, requests: Iterable[Request]):
+        for request in requests:
+            self.append(request)
+
+    def extend_batch(self, batch: "RequestBatch"):
+        """
+        append all requests of another batch
+        """
+        for column in RequestBatch.__slots__:
+            getattr(self, column).extend(getattr(batch, column))
+
+    def __getitem__(self, i: int) -> Request:
+        return Request.from_values(self.ip_address[i], self.time_local[i], self.type[i], self.route[i], self.protocol[i],
+                                   str(self.status[i]), str(self.bytes_sent[i]), self.referer[i], self.user_agent[i], self.extra[i])
+
+    def __iter__(self) -> Iterator[Request]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, indices: list[int]|range) -> "RequestBatch":
+        """
+        get a new batch with the requests at indices
+        """
+        batch = RequestBatch()
+        for column in RequestBatch.__slots__:
+            values = getattr(self, column)
+            if isinstance(indices, range):
+                selected = values[indices.start:indices.stop:indices.step]
+            else:
+                selected = [ values[i] for i in indices ]
+                if isinstance(values, array):
+                    selected = array(values.typecode, selected)
+            setattr(batch, column, selected)
+        return batch
+
+    def split(self, size: int) -> Iterator["RequestBatch"]:
+        """
+        yield batches with at most size requests
+        """
+        if len(self) <= size:
+            yield self
+            return
+        for start in range(0, len(self), size):
+            yield self.select(range(start, min(start + size, len(self))))
+
+    def __repr__(self):
+        return f"RequestBatch({len(self)} requests)"
 
 
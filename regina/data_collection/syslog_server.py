@@ -0,0 +1,197 @@
+"""collection of access log lines that nginx sends via syslog"""
+import asyncio
+import socket
+from os import path, remove, stat
+from re import compile as re_compile
+from signal import SIGTERM, SIGINT
+from stat import S_ISSOCK
+
+from regina.data_collection.parse_log import parse_lines
+from regina.utility.utility import pdebug, warning, pmessage
+from regina.utility.globals import settings
+
+"""
+Receive the access log from nginx over a unix datagram socket or udp, eg with this nginx configuration:
+    access_log syslog:server=unix:/run/regina.sock combined;
+and add the requests to the database in micro-batches
+"""
+
+# size of the receive buffer of the socket, which holds the messages while the queue is full or requests are added to the database
+# the kernel limits it to net.core.rmem_max
+receive_buffer_size = 4 * 1024 * 1024
+
+# <PRI>Mmm dd hh:mm:ss [hostname ]tag[pid]: message
+re_rfc3164 = re_compile(r"<\d{1,3}>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d (?:\S+ )?[^\s:\[]+(?:\[\d+\])?: ?(.*)")
+# <PRI>VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA [MSG]
+re_rfc5424 = re_compile(r"<\d{1,3}>\d{1,2} \S+ \S+ \S+ \S+ \S+ (?:-|(?:\[(?:[^\]\\]|\\.)*\])+)(?: (?:\ufeff)?(.*))?")
+
+
+def parse_syslog_message(message: str) -> str|None:
+    """
+    get the log line from a RFC3164 (which nginx uses) or RFC5424 syslog message
+    @returns the line, None if the message is not a valid syslog message
+    """
+    message = message.rstrip("\r\n\0")
+    m = re_rfc3164.fullmatch(message) or re_rfc5424.fullmatch(message)
+    if m is None: return None
+    return m.group(1)
+
+
+def parse_syslog_address(address: str) -> tuple[socket.AddressFamily, str|tuple[str, int]]:
+    """
+    parse the address like nginx does for syslog:server=
+    @param address: unix:/path/to/socket, host:port, [ipv6]:port or host, which uses port 514
+    @returns socket family, address for bind
+    @raises ValueError: if the address is invalid
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, port = address, 514
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        if rest: port = rest.removeprefix(":")
+        family = socket.AF_INET6
+    else:
+        if ":" in address:
+            host, _, port = address.rpartition(":")
+        family = socket.AF_INET
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"Invalid port in syslog address: '{address}'")
+    return family, (host, port)
+
+
+class SyslogProtocol(asyncio.DatagramProtocol):
+    """
+    Put the log lines from the received syslog messages into a bounded queue.
+    When the queue is full, reading from the socket is paused until half of the queue was processed,
+    so that the datagrams wait in the receive buffer of the socket instead of the memory of regina.
+    """
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.transport = None
+        self.paused = False
+        self.invalid_count = 0
+        self.dropped_count = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        line = parse_syslog_message(data.decode("utf-8", errors="replace"))
+        if line is None:
+            self.invalid_count += 1
+            pdebug(f"SyslogProtocol: Invalid syslog message: '{data}'", lvl=2)
+            return
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            # only if the transport does not support pause_reading
+            self.dropped_count += 1
+            return
+        if self.queue.full() and not self.paused and hasattr(self.transport, "pause_reading"):
+            pdebug(f"SyslogProtocol: Queue is full, pausing", lvl=2)
+            self.transport.pause_reading()
+            self.paused = True
+
+    def resume_if_drained(self):
+        if self.paused and self.queue.qsize() <= self.queue.maxsize // 2:
+            pdebug(f"SyslogProtocol: Resuming", lvl=2)
+            self.transport.resume_reading()
+            self.paused = False
+
+    def error_received(self, exc):
+        warning(f"SyslogProtocol: {exc}")
+
+
+class SyslogServer:
+    """
+    Add the requests from the syslog messages to the database.
+    Lines are collected until there are batch_size lines or follow_interval seconds passed since the first one,
+    then they are added through Database.add_requests.
+    Adding them blocks the event loop, while that happens the datagrams are buffered by the socket.
+    """
+    def __init__(self, db, address: str):
+        self.db = db
+        self.address = address
+        self.family, self.bind_address = parse_syslog_address(address)
+        self.interval = settings["data-collection"]["follow_interval"]
+        self.batch_size = settings["data-collection"]["batch_size"]
+        self.queue_size = settings["data-collection"]["syslog_queue_size"]
+        self.request_count = 0
+
+    def _add_lines(self, lines: list[str]):
+        request_count, visitors_count, new_visitors_count = self.db.add_requests(parse_lines(lines))
+        self.request_count += request_count
+        pdebug(f"SyslogServer: + {request_count} new requests, {visitors_count} visitors, {new_visitors_count} new visitors", lvl=1)
+
+    async def _consume(self, queue: asyncio.Queue, protocol: SyslogProtocol):
+        """
+        add the lines in the queue to the database until it contains None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            line = await queue.get()
+            if line is None: return
+            lines = [line]
+            deadline = loop.time() + self.interval
+            while len(lines) < self.batch_size:
+                if queue.empty():
+                    protocol.resume_if_drained()
+                    try:
+                        line = await asyncio.wait_for(queue.get(), max(0, deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    line = queue.get_nowait()
+                if line is None:
+                    self._add_lines(lines)
+                    return
+                lines.append(line)
+            self._add_lines(lines)
+            protocol.resume_if_drained()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in [SIGINT, SIGTERM]:
+            loop.add_signal_handler(signum, stop.set)
+
+        if self.family == socket.AF_UNIX and path.exists(self.bind_address) and S_ISSOCK(stat(self.bind_address).st_mode):
+            pdebug(f"SyslogServer: Removing old socket '{self.bind_address}'", lvl=1)
+            remove(self.bind_address)
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        transport, protocol = await loop.create_datagram_endpoint(lambda: SyslogProtocol(queue), local_addr=self.bind_address, family=self.family)
+        try:
+            transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        except OSError as e:
+            warning(f"SyslogServer: Could not set the receive buffer size: {e}")
+        pmessage(f"Listening for syslog messages on '{self.address}', new requests are added at most {self.interval} seconds after they were received")
+        consumer = asyncio.create_task(self._consume(queue, protocol))
+        try:
+            stopped = asyncio.create_task(stop.wait())
+            await asyncio.wait([consumer, stopped], return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+        finally:
+            transport.close()
+            if self.family == socket.AF_UNIX and path.exists(self.bind_address):
+                remove(self.bind_address)
+            for signum in [SIGINT, SIGTERM]:
+                loop.remove_signal_handler(signum)
+        if not consumer.done():
+            # add the remaining lines
+            await queue.put(None)
+        await consumer
+        if protocol.invalid_count or protocol.dropped_count:
+            warning(f"SyslogServer: Ignored {protocol.invalid_count} invalid messages, dropped {protocol.dropped_count} messages because the queue was full")
+        return self.request_count
+
+
+def run_syslog_server(db, address: str) -> int:
+    """
+    Receive syslog messages on address and add the requests to the database until regina receives SIGINT or SIGTERM
+    @param address: see parse_syslog_address
+    @returns number of added requests
+    """
+    return asyncio.run(SyslogServer(db, address).serve())
@@ -0,0 +1,73 @@
+"""user agent classification"""
+from collections import OrderedDict
+from typing import NamedTuple
+
+from regina.utility.globals import user_agent_platforms, user_agent_browsers
+
+"""
+find the platform and browser in a user agent string
+"""
+
+class UserAgent(NamedTuple):
+    platform: str
+    browser: str
+    is_mobile: bool
+    # no known platform or browser, visitors with this user agent are never human
+    is_bot: bool
+
+
+def get_platform(user_agent: str) -> str:
+    # the first platform in user_agent_platforms that is in the user agent
+    for platform in user_agent_platforms:
+        if platform in user_agent:
+            return platform
+    return ""
+
+def get_browser(user_agent: str) -> str:
+    # the first browser in user_agent_browsers that is in the user agent
+    for browser in user_agent_browsers:
+        if browser in user_agent:
+            return browser
+    return ""
+
+def get_mobile(user_agent: str) -> bool:
+    return "Mobi" in user_agent
+
+def classify_user_agent(user_agent: str) -> UserAgent:
+    platform = get_platform(user_agent)
+    browser = get_browser(user_agent)
+    return UserAgent(platform, browser, get_mobile(user_agent), not (platform and browser))
+
+
+class UserAgentCache:
+    """
+    Cache for classify_user_agent
+    Most requests come from a few thousand different user agents, so each of them only needs to be classified once.
+    if max_size is given, the least recently used user agents are removed when the cache is full
+    """
+    def __init__(self, max_size: int|None=None):
+        self.max_size = max_size
+        self.user_agents: OrderedDict[str, UserAgent] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.user_agents)
+
+    def get(self, user_agent: str) -> UserAgent:
+        classification = self.user_agents.get(user_agent)
+        if classification is None:
+            self.misses += 1
+            classification = classify_user_agent(user_agent)
+            self.user_agents[user_agent] = classification
+            if self.max_size and len(self.user_agents) > self.max_size:
+                self.user_agents.popitem(last=False)
+        else:
+            self.hits += 1
+            if self.max_size: self.user_agents.move_to_end(user_agent)
+        return classification
+
+    def __repr__(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"UserAgentCache: size={len(self)}, max_size={self.max_size}, hits={self.hits}, misses={self.misses}, hit_rate={hit_rate:.1f}%"
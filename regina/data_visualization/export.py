@@ -0,0 +1,155 @@
+"""export of the rankings and histories"""
+import csv
+import json
+from abc import ABC, abstractmethod
+from os import path, remove, replace
+from pickle import dump
+from typing import Iterable
+
+import numpy as np
+
+"""
+Write the rankings and histories to data files, row by row, so that a table is never built as one large string
+"""
+
+# buffer size of the exported files
+buffer_size = 64 * 1024
+
+
+class TableWriter(ABC):
+    """
+    Base class for writing a table with a title and named columns to a data file.
+    Use it as context manager: the table is written to a temporary file, which replaces filename when the context is left.
+    If the context is left with an exception, the temporary file is removed and filename is not changed.
+    """
+    def __init__(self, filename: str, title: str, columns: tuple[str, ...]):
+        self.filename = filename
+        self.temp_filename = filename + ".tmp"
+        self.title = title
+        self.columns = columns
+
+    @abstractmethod
+    def write_row(self, row: tuple):
+        pass
+
+    def write_rows(self, rows: Iterable[tuple]):
+        for row in rows:
+            self.write_row(row)
+
+    def _finish(self):
+        """
+        write the remaining data to temp_filename and close it
+        """
+        pass
+
+    def close(self):
+        try:
+            self._finish()
+        except:
+            self.abort()
+            raise
+        replace(self.temp_filename, self.filename)
+
+    def abort(self):
+        """
+        remove the incomplete temporary file
+        """
+        if path.exists(self.temp_filename):
+            remove(self.temp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CSVWriter(TableWriter):
+    """
+    First line is the title, second line the column names, then one line per row. Strings are quoted.
+    """
+    def __init__(self, filename: str, title: str, columns: tuple[str, ...]):
+        super().__init__(filename, title, columns)
+        self.file = open(self.temp_filename, "w", newline="", buffering=buffer_size)
+        self.writer = csv.writer(self.file, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        self.writer.writerow([title])
+        self.writer.writerow(columns)
+
+    def write_row(self, row: tuple):
+        self.writer.writerow(row)
+
+    def write_rows(self, rows: Iterable[tuple]):
+        self.writer.writerows(rows)
+
+    def _finish(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        super().abort()
+
+
+class JSONLinesWriter(TableWriter):
+    """
+    One json object { column: value } per row and line
+    """
+    def __init__(self, filename: str, title: str, columns: tuple[str, ...]):
+        super().__init__(filename, title, columns)
+        self.file = open(self.temp_filename, "w", buffering=buffer_size)
+
+    def write_row(self, row: tuple):
+        self.file.write(json.dumps(dict(zip(self.columns, row))) + "\n")
+
+    def _finish(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+        super().abort()
+
+
+class PickleWriter(TableWriter):
+    """
+    The rows as python type list[tuple]. The rows are pickled as a whole when the writer is closed.
+    """
+    def __init__(self, filename: str, title: str, columns: tuple[str, ...]):
+        super().__init__(filename, title, columns)
+        self.rows = []
+
+    def write_row(self, row: tuple):
+        self.rows.append(tuple(row))
+
+    def _finish(self):
+        with open(self.temp_filename, "wb") as file:
+            dump(self.rows, file)
+
+
+class NPZWriter(TableWriter):
+    """
+    Compressed numpy archive with one array per column, which can be loaded with numpy.load without parsing text.
+    The values are collected per column and written when the writer is closed.
+    """
+    def __init__(self, filename: str, title: str, columns: tuple[str, ...]):
+        super().__init__(filename, title, columns)
+        self.column_values: list[list] = [ [] for _ in columns ]
+
+    def write_row(self, row: tuple):
+        for values, value in zip(self.column_values, row):
+            values.append(value)
+
+    def _finish(self):
+        # numpy.savez would append .npz to filenames without that extension
+        with open(self.temp_filename, "wb") as file:
+            np.savez_compressed(file, **{ column: np.array(values) for column, values in zip(self.columns, self.column_values) })
+
+
+# filetype: writer
+table_writers: dict[str, type[TableWriter]] = {
+    "csv": CSVWriter,
+    "jsonl": JSONLinesWriter,
+    "pkl": PickleWriter,
+    "npz": NPZWriter,
+}
@@ -1,62 +1,99 @@
 from regina.database import Database
+from regina.data_visualization.utility import get_rollup_date_constraint
+
+"""
+all statistics are computed from the daily rollup tables, timestamps are therefore rounded to whole days
+"""
 
 def get_visitor_count_between(db: Database, timestamps: tuple[int, int], only_human=False):
-    return db(f"""SELECT COUNT(visitor_id)
-    FROM visitor AS v
-    WHERE EXISTS (
-        SELECT 1
-        FROM request as r
-        WHERE r.visitor_id = v.visitor_id
-        AND r.time BETWEEN {timestamps[0]} AND {timestamps[1]}
-    )
-    {'AND v.is_human = 1' if only_human else ''}""")[0][0]
+    if only_human:
+        return db(f"""SELECT COUNT(DISTINCT d.visitor_id)
+        FROM visitor_day AS d
+        JOIN visitor AS v ON v.visitor_id = d.visitor_id
+        WHERE {get_rollup_date_constraint()}
+        AND v.is_human = 1""", timestamps)[0][0]
+    else:
+        return db(f"""SELECT COUNT(DISTINCT d.visitor_id)
+        FROM visitor_day AS d
+        WHERE {get_rollup_date_constraint()}""", timestamps)[0][0]
 
 def get_request_count_between(db: Database, timestamps: tuple[int, int], only_human=False):
     if only_human:
-        return db(f"""SELECT COUNT(r.request_id)
-        FROM request AS r
-        JOIN (
-            SELECT visitor_id
-            FROM visitor
-            {'WHERE is_human = 1' if only_human else ''}
-        ) AS v ON v.visitor_id = r.visitor_id
-        WHERE r.time BETWEEN {timestamps[0]} AND {timestamps[1]}""")[0][0]
+        return db(f"""SELECT COALESCE(SUM(d.request_count), 0)
+        FROM visitor_day AS d
+        JOIN visitor AS v ON v.visitor_id = d.visitor_id
+        WHERE {get_rollup_date_constraint()}
+        AND v.is_human = 1""", timestamps)[0][0]
     else:
-        return db(f"""SELECT COUNT(*)
-        FROM request
-        WHERE time BETWEEN {timestamps[0]} AND {timestamps[1]}""")[0][0]
+        return db(f"""SELECT COALESCE(SUM(d.request_count), 0)
+        FROM referer_day AS d
+        WHERE {get_rollup_date_constraint()}""", timestamps)[0][0]
 
 
 def get_new_visitor_count_between(db: Database, timestamps: tuple[int, int]):
     return db(f"""SELECT COUNT(*)
-    FROM visitor AS v
-    JOIN (
-        SELECT visitor_id, MIN(time) AS first_request_time
-        FROM request
+    FROM (
+        SELECT visitor_id, MIN(date) AS date
+        FROM visitor_day
         GROUP BY visitor_id
-    ) AS r ON v.visitor_id = r.visitor_id
-    WHERE r.first_request_time BETWEEN {timestamps[0]} AND {timestamps[1]}""")[0][0]
+    ) AS d
+    WHERE {get_rollup_date_constraint()}""", timestamps)[0][0]
 
 def get_request_from_new_visitor_count_between(db: Database, timestamps: tuple[int, int]):
-    return db(f"""SELECT COUNT(*)
-    FROM request AS r
+    return db(f"""SELECT COALESCE(SUM(r.request_count), 0)
+    FROM visitor_day AS r
     JOIN (
-        SELECT visitor_id, MIN(time) AS first_request_time
-        FROM request
+        SELECT visitor_id, MIN(date) AS date
+        FROM visitor_day
         GROUP BY visitor_id
-    ) AS v ON r.visitor_id = v.visitor_id
-    WHERE v.first_request_time BETWEEN {timestamps[0]} AND {timestamps[1]}""")[0][0]
+    ) AS d ON r.visitor_id = d.visitor_id
+    WHERE {get_rollup_date_constraint()}""", timestamps)[0][0]
 
 
 def get_mobile_visitor_count_between(db: Database, timestamps: tuple[int, int], only_human=True) -> float:
-    return db(f"""SELECT COUNT(*)
-    FROM visitor AS v
-    WHERE EXISTS (
-        SELECT 1
-        FROM request as r
-        WHERE r.visitor_id = v.visitor_id
-        AND r.time BETWEEN {timestamps[0]} AND {timestamps[1]}
-    )
+    return db(f"""SELECT COUNT(DISTINCT d.visitor_id)
+    FROM visitor_day AS d
+    JOIN visitor AS v ON v.visitor_id = d.visitor_id
+    WHERE {get_rollup_date_constraint()}
     {'AND v.is_human = 1' if only_human else ''}
-    AND v.is_mobile = 1""")[0][0]
+    AND v.is_mobile = 1""", timestamps)[0][0]
+
+
+
+def get_history(db: Database, timestamps: tuple[int, int], date_format="%Y-%m-%d") -> tuple[list[str], dict[str, list[int]]]:
+    """
+    get the visitor and request history, grouped by date in a single query per series
+    @param date_format: strftime format of the dates, eg "%Y-%m-%d" for daily or "%Y-%m" for monthly history
+    @returns dates, { series_name: [ count for each date ] }
+        series are: visitors, visitors_human, visitors_new, requests, requests_human, requests_new
+        new visitors are counted at the date of their first request, their requests are counted at the same date
+    """
+    counts: dict[str, dict[str, int]] = {}  # date: { series_name: count }
+    for date, visitors, visitors_human, requests, requests_human in db(f"""SELECT strftime(?, d.date) AS month_or_day,
+        COUNT(DISTINCT d.visitor_id),
+        COUNT(DISTINCT CASE WHEN v.is_human = 1 THEN d.visitor_id END),
+        SUM(d.request_count),
+        SUM(CASE WHEN v.is_human = 1 THEN d.request_count ELSE 0 END)
+        FROM visitor_day AS d
+        JOIN visitor AS v ON v.visitor_id = d.visitor_id
+        WHERE {get_rollup_date_constraint()}
+        GROUP BY month_or_day""", (date_format, *timestamps)):
+        counts[date] = { "visitors": visitors, "visitors_human": visitors_human, "requests": requests, "requests_human": requests_human }
+
+    for date, visitors_new, requests_new in db(f"""SELECT strftime(?, d.date) AS month_or_day,
+        COUNT(DISTINCT d.visitor_id),
+        SUM(r.request_count)
+        FROM (
+            SELECT visitor_id, MIN(date) AS date
+            FROM visitor_day
+            GROUP BY visitor_id
+        ) AS d
+        JOIN visitor_day AS r ON r.visitor_id = d.visitor_id
+        WHERE {get_rollup_date_constraint()}
+        GROUP BY month_or_day""", (date_format, *timestamps)):
+        counts.setdefault(date, {}).update(visitors_new=visitors_new, requests_new=requests_new)
 
+    dates = sorted(counts.keys())
+    series_names = ["visitors", "visitors_human", "visitors_new", "requests", "requests_human", "requests_new"]
+    history = { name: [ counts[date].get(name, 0) for date in dates ] for name in series_names }
+    return dates, history
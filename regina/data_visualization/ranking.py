@@ -1,10 +1,10 @@
-from re import fullmatch
+import re
 
 from regina.database import Database
 from regina.utility.globals import settings
-from regina.utility.utility import pdebug, warning, is_blacklisted, is_whitelisted
+from regina.utility.utility import pdebug, warning, get_filter
 from regina.utility.sql_util import sanitize
-from regina.data_visualization.utility import is_valid_status, cleanup_referer
+from regina.data_visualization.utility import cleanup_referer, get_rollup_date_constraint
 
 
 def get_route_ranking(db: Database, timestamps: tuple[int, int]) -> list[tuple[int, str]]:
@@ -12,21 +12,22 @@ def get_route_ranking(db: Database, timestamps: tuple[int, int]) -> list[tuple[i
     :returns [(request_count, route name)]
     """
     ranking = []
-    for (route_id, name) in db(f"SELECT route_id, name FROM route"):
-        if     is_blacklisted(name, settings["rankings"]["route_blacklist"]): continue
-        if not is_whitelisted(name, settings["rankings"]["route_whitelist"]): continue
-        if settings["rankings"]["route_ignore_404"]:  # use only succesful routes
-            success = False
-            for (status, ) in db(f"SELECT status FROM request WHERE route_id = {route_id}"):
-                if is_valid_status(status):
-                    pdebug(f"get_route_ranking: success code {status} for route with route_id {route_id} and name {name}", lvl=4)
-                    success = True
-                    break
-            if not success:
-                pdebug(f"get_route_ranking: route with route_id {route_id} and name {name} has only requests resulting in error", lvl=3)
-                continue
-        db.execute(f"SELECT COUNT(*) FROM request WHERE route_id = {route_id} AND time BETWEEN {timestamps[0]} AND {timestamps[1]}")
-        ranking.append((db.fetchone()[0], name))
+    route_filter = get_filter(settings["rankings"]["route_blacklist"], settings["rankings"]["route_whitelist"])
+    if settings["rankings"]["route_ignore_404"]:  # use only routes with at least one successful request
+        max_success_status = 400 if settings["data-collection"]["status_300_is_success"] else 300
+        success_constraint = "AND d.route_id IN (SELECT route_id FROM route_day WHERE status < ?)"
+        params = (*timestamps, max_success_status)
+    else:
+        success_constraint = ""
+        params = timestamps
+    for name, count in db(f"""SELECT ro.name, SUM(d.request_count)
+        FROM route_day AS d
+        JOIN route AS ro ON ro.route_id = d.route_id
+        WHERE {get_rollup_date_constraint()}
+        {success_constraint}
+        GROUP BY d.route_id""", params):
+        if not route_filter(name): continue
+        ranking.append((count, name))
     ranking.sort()
     return ranking
 
@@ -34,11 +35,12 @@ def route_ranking_group_routes(route_ranking: list[tuple[int, str]]):
     """
     group the routes in the route ranking according the groups defined in the config section "route-groups"
     """
+    groups = [ (group_name, re.compile(group_regexp)) for group_name, group_regexp in settings["route-groups"].items() ]
     ranking = {}
     for count, route in route_ranking:
         ingroup = False
-        for group_name, group_regexp in settings["route-groups"].items():
-            if fullmatch(group_regexp, route):
+        for group_name, group_regexp in groups:
+            if group_regexp.fullmatch(route):
                 if group_name in ranking:
                     ranking[group_name] += count
                 else:
@@ -56,11 +58,14 @@ def get_referer_ranking(db: Database, timestamps: tuple[int, int]) -> list[tuple
     @returns [(count, referer)]
     """
     ranking = []
-    for referer_id, name in db(f"SELECT referer_id, name FROM referer"):
-        if     is_blacklisted(name, settings["rankings"]["referer_blacklist"]): continue
-        if not is_whitelisted(name, settings["rankings"]["referer_whitelist"]): continue
-        db.execute(f"SELECT COUNT(*) FROM request WHERE referer_id = {referer_id} AND time BETWEEN {timestamps[0]} AND {timestamps[1]}")
-        ranking.append((db.fetchone()[0], name))
+    referer_filter = get_filter(settings["rankings"]["referer_blacklist"], settings["rankings"]["referer_whitelist"])
+    for name, count in db(f"""SELECT re.name, SUM(d.request_count)
+        FROM referer_day AS d
+        JOIN referer AS re ON re.referer_id = d.referer_id
+        WHERE {get_rollup_date_constraint()}
+        GROUP BY d.referer_id""", timestamps):
+        if not referer_filter(name): continue
+        ranking.append((count, name))
     ranking.sort()
     return ranking
 
@@ -90,17 +95,17 @@ def get_city_ranking(db: Database, timestamps: tuple[int, int], add_country_code
         AND i.ip_range_id = v.ip_range_id
         AND EXISTS(
             SELECT 1
-            FROM request AS r
-            WHERE r.visitor_id = v.visitor_id
-            AND r.time BETWEEN {timestamps[0]} AND {timestamps[1]}
+            FROM visitor_day AS d
+            WHERE d.visitor_id = v.visitor_id
+            AND {get_rollup_date_constraint()}
         )
         {'AND v.is_human = 1' if only_human else ''}
         GROUP BY ci.name
         ORDER BY COUNT(v.visitor_id)
-        """)
+        """, timestamps)
+    city_filter = get_filter(settings["rankings"]["city_blacklist"], settings["rankings"]["city_whitelist"])
     for code, name, count in results:
-        if     is_blacklisted(name, settings["rankings"]["city_blacklist"]): continue
-        if not is_whitelisted(name, settings["rankings"]["city_whitelist"]): continue
+        if not city_filter(name): continue
         if add_country_code:
             name = f"{name} ({code})"
         ranking.append((count, name))
@@ -151,39 +156,35 @@ def get_country_ranking(db: Database, timestamps: tuple[int, int], only_human=Tr
         AND i.ip_range_id = v.ip_range_id
         AND EXISTS(
             SELECT 1
-            FROM request AS r
-            WHERE r.visitor_id = v.visitor_id
-            AND r.time BETWEEN {timestamps[0]} AND {timestamps[1]}
+            FROM visitor_day AS d
+            WHERE d.visitor_id = v.visitor_id
+            AND {get_rollup_date_constraint()}
         )
         {'AND v.is_human = 1' if only_human else ''}
         GROUP BY co.name
         ORDER BY COUNT(v.visitor_id)
-        """)
+        """, timestamps)
+    country_filter = get_filter(settings["rankings"]["country_blacklist"], settings["rankings"]["country_whitelist"])
     for name, count in results:
-        if     is_blacklisted(name, settings["rankings"]["country_blacklist"]): continue
-        if not is_whitelisted(name, settings["rankings"]["country_whitelist"]): continue
+        if not country_filter(name): continue
         ranking.append((count, name))
     ranking.sort()
     return ranking
 
 
 def _get_platform_or_browser_ranking(db: Database, timestamps: tuple[int, int], table: str, only_human=False):
+    """
+    @returns [(visitor_count, name)]
+    """
     ranking = []
-    for (table_id, name) in db(f"SELECT {table}_id, name FROM {table}"):
-        # if     is_blacklisted(name, settings["rankings"][f"{table}_blacklist"]): continue
-        # if not is_whitelisted(name, settings["rankings"][f"{table}_whitelist"]): continue
+    for name, count in db(f"""SELECT t.name, COUNT(DISTINCT d.visitor_id)
+        FROM visitor_day AS d
+        JOIN visitor AS v ON v.visitor_id = d.visitor_id
+        JOIN {table} AS t ON t.{table}_id = v.{table}_id
+        WHERE {get_rollup_date_constraint()}
+        {'AND v.is_human = 1' if only_human else ''}
+        GROUP BY v.{table}_id""", timestamps):
         if name == "None": continue
-        db.execute(f"""SELECT COUNT(v.visitor_id)
-        FROM visitor AS v, {table} AS t
-        WHERE v.{table}_id = {table_id}
-        AND EXISTS(
-            SELECT 1
-            FROM request AS r
-            WHERE r.visitor_id = v.visitor_id
-            AND r.time BETWEEN {timestamps[0]} AND {timestamps[1]}
-        )
-        {'AND v.is_human = 1' if only_human else ''}""")
-        count = db.fetchone()[0]
         if count > 0:
             ranking.append((count, name))
     ranking.sort()
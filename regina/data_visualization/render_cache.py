@@ -0,0 +1,80 @@
+"""cache for the generated plots and data files"""
+import json
+from hashlib import sha256
+from os import path, makedirs, replace, stat
+
+from regina.utility.utility import pdebug, warning
+
+"""
+Remember a hash of the input of every generated file, so that files whose input did not change are not generated again.
+This also keeps their modification time, so that browsers and CDNs do not download them again.
+"""
+
+class RenderCache:
+    """
+    Map the path of each generated file to the hash of its input and the size and modification time of the file after it was written.
+    A file is only skipped if it still has this size and modification time, so files that were changed or deleted are generated again.
+    """
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.entries: dict[str, dict] = {}
+        # filename: input_hash of the files that are being generated
+        self.pending: dict[str, str] = {}
+        self.skipped_count = 0
+        try:
+            with open(cache_path, "r") as file:
+                self.entries = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            warning(f"RenderCache: Could not load '{cache_path}', generating all files: {e}")
+
+    @staticmethod
+    def get_hash(*input) -> str:
+        """
+        @param input: objects whose repr only depends on their values, eg numbers, strings, bytes and lists, tuples or dicts of those
+        """
+        return sha256(repr(input).encode()).hexdigest()
+
+    def is_unchanged(self, filename: str, input_hash: str) -> bool:
+        entry = self.entries.get(path.abspath(filename))
+        if entry is None or entry["hash"] != input_hash: return False
+        try:
+            st = stat(filename)
+        except OSError:
+            return False
+        return entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+    def needs_update(self, filename: str, input_hash: str) -> bool:
+        """
+        @returns whether the file has to be generated. If it is, save has to be called after it was written.
+        """
+        if self.is_unchanged(filename, input_hash):
+            pdebug(f"RenderCache: Skipping unchanged file '{filename}'", lvl=2)
+            self.skipped_count += 1
+            return False
+        self.pending[path.abspath(filename)] = input_hash
+        return True
+
+    def save(self):
+        """
+        store the hashes of the files that were generated since the last save
+        """
+        for filename, input_hash in self.pending.items():
+            try:
+                st = stat(filename)
+            except OSError:
+                continue
+            self.entries[filename] = { "hash": input_hash, "size": st.st_size, "mtime_ns": st.st_mtime_ns }
+        self.pending.clear()
+        try:
+            makedirs(path.dirname(self.cache_path), exist_ok=True)
+            # write to a temporary file first, so that the cache is never incomplete
+            with open(self.cache_path + ".tmp", "w") as file:
+                json.dump(self.entries, file)
+            replace(self.cache_path + ".tmp", self.cache_path)
+        except OSError as e:
+            warning(f"RenderCache: Could not save '{self.cache_path}': {e}")
+
+    def __repr__(self):
+        return f"RenderCache: '{self.cache_path}', entries={len(self.entries)}, skipped={self.skipped_count}"
@@ -62,3 +62,10 @@ def len_list_list(l: list[list]):
     return size
 
 
+
+
+def get_rollup_date_constraint(column="d.date") -> str:
+    """
+    constraint for the date column of the rollup tables, takes the (min, max) timestamps as parameters
+    """
+    return f"{column} BETWEEN DATE(?, 'unixepoch', 'localtime') AND DATE(?, 'unixepoch', 'localtime')"
@@ -1,16 +1,20 @@
 # from sys import path
 # print(f"{__file__}: __name__={__name__}, __package__={__package__}, sys.path[0]={path[0]}")
-import matplotlib.pyplot as plt
-from pickle import dump
-from os import path, makedirs
+from os import path, makedirs, cpu_count
 from datetime import datetime as dt
+from multiprocessing import Pool
+from importlib.metadata import version
+from typing import Callable, NamedTuple
+import numpy as np
 
 # local
 from regina.database import Database
-from regina.utility.sql_util import get_date_constraint, sanitize
+from regina.utility.sql_util import sanitize
 from regina.utility.utility import pdebug, warning, error, make_parent_dirs, dict_str, pmessage
-from regina.utility.globals import settings
+from regina.utility.globals import settings, cache_dir, init_worker_settings, get_version
 from regina.data_visualization.utility import len_list_list
+from regina.data_visualization.render_cache import RenderCache
+from regina.data_visualization.export import table_writers
 from regina.data_visualization.ranking import get_referer_ranking, cleanup_referer_ranking, get_route_ranking, route_ranking_group_routes, get_browser_ranking, get_platform_ranking, get_city_ranking, get_country_ranking, make_ranking_relative
 import regina.data_visualization.history as h
 
@@ -65,63 +69,81 @@ color_settings_history = {
 #
 # PLOTTING
 #
-def add_vertikal_labels_in_bar_plot(labels, max_y_val, ax, bar_plot):
+def get_pyplot():
+    """
+    import matplotlib when the first plot is generated, since the import takes several hundred milliseconds
+    """
+    import matplotlib
+    # plots are only saved to files, so no gui backend is needed
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def get_extension_colors(color_settings: dict[str, list[str]]) -> dict[str, str]:
+    """
+    @param color_settings: { color: [extensions] }
+    @returns { extension: color }, if an extension is listed for multiple colors, the last one is used
+    """
+    return { extension: color for color, extensions in color_settings.items() for extension in extensions }
+
+def get_bar_colors(names: list[str], color_settings: dict|list) -> list[str]|np.ndarray:
+    """
+    @param color_settings: { color: [extensions] } to color the bars by the extension of their name or list of colors that is repeated
+    """
+    if isinstance(color_settings, dict):
+        extension_colors = get_extension_colors(color_settings)
+        return [ extension_colors.get(name.rpartition(".")[2], palette["blue"]) for name in names ]
+    if color_settings:
+        return np.array(color_settings)[np.arange(len(names)) % len(color_settings)]
+    return [palette["blue"]] * len(names)
+
+def add_vertikal_labels_in_bar_plot(labels, max_y_val, ax, xdata: np.ndarray, ydata: np.ndarray):
     """
     Add the label of the bar in or on top of the bar, depending on the bar size
     """
     # pdebug("add_vertikal_labels_in_bar_plot:", labels)
-    for idx,rect in enumerate(bar_plot):
-        height = rect.get_height()
-        if height > 0.6 * max_y_val:  # if the bar is large, put label in the bar
-            height = 0.05 * max_y_val
-        ax.text(rect.get_x() + rect.get_width()/2., height + 0.025 * max_y_val,
-                labels[idx],
-                ha='center', va='bottom', rotation=90)
-
-def add_labels_at_top_of_bar(xdata, ydata, max_y_val, ax, bar_plot):
+    # if the bar is large, put label in the bar
+    y_positions = np.where(ydata > 0.6 * max_y_val, 0.05 * max_y_val, ydata) + 0.025 * max_y_val
+    for x, y, label in zip(xdata, y_positions, labels):
+        ax.text(x, y, label, ha='center', va='bottom', rotation=90)
+
+def add_labels_at_top_of_bar(xdata: np.ndarray, ydata: np.ndarray, max_y_val, ax):
     """
     add the height of the bar on the top of each bar
     """
     # pdebug("add_labels_at_top_of_bar:", xdata, ydata)
-    y_offset = 0.05 * max_y_val
-    for idx,rect in enumerate(bar_plot):
-        ax.text(rect.get_x() + rect.get_width()/2, ydata[idx] - y_offset, round(ydata[idx], 1), ha='center', bbox=dict(facecolor='white', alpha=0.8))
+    y_positions = ydata - 0.05 * max_y_val
+    for x, y, count in zip(xdata, y_positions, ydata.tolist()):
+        ax.text(x, y, round(count, 1), ha='center', bbox=dict(facecolor='white', alpha=0.8))
 
 def plot_ranking(ranking: list[tuple[int or float, str]], fig=None, xlabel="", ylabel="", color_settings:dict|list=[], figsize=None):
     """
     make a bar plot of the ranking
     """
     # pdebug(f"plot_ranking: ranking={ranking}")
+    plt = get_pyplot()
     if not fig:
         fig = plt.figure(figsize=figsize, dpi=settings["plot-generation"]["dpi"], linewidth=1.0, frameon=True, subplotpars=None, layout=None)
     # create new axis if none is given
     ax = fig.add_subplot(xlabel=xlabel, ylabel=ylabel)
-    # fill x y data
-    if len(ranking) > settings["rankings"]["route_plot_max_routes"]:
-        start_index = len(ranking) - settings["rankings"]["route_plot_max_routes"]
-    else: start_index = 0
-    x_names = []
-    y_counts = []
-    colors = []
-    for i in range(start_index, len(ranking)):
-        x_names.append(ranking[i][1])
-        y_counts.append(ranking[i][0])
-        ft = ranking[i][1].split(".")[-1]
-        color = palette["blue"]
-        # if not color_settings: color = palette["blue"]
-        if isinstance(color_settings, dict):
-            for key, val in color_settings.items():
-                if ft in val: color = key
-            if not color: color = palette["blue"]
-        elif isinstance(color_settings, list):
-            # print(color_settings, (i - start_index) % len(color_settings))
-            color = color_settings[(i - start_index) % len(color_settings)]
-        colors.append(color)
-    bar = ax.bar(x_names, y_counts, tick_label="", color=colors)
-
-    if len(y_counts) > 0:
-        add_vertikal_labels_in_bar_plot(x_names, y_counts[-1], ax, bar)
-        if settings["plot-generation"]["add_count_label"]: add_labels_at_top_of_bar(x_names, y_counts, y_counts[-1], ax, bar)
+    # fill x y data with the largest entries, which are at the end of the ranking
+    start_index = max(0, len(ranking) - settings["rankings"]["route_plot_max_routes"])
+    x_names = [ name for _, name in ranking[start_index:] ]
+    y_counts = np.array([ count for count, _ in ranking[start_index:] ])
+    x_positions = np.arange(len(x_names))
+    colors = get_bar_colors(x_names, color_settings)
+
+    label_max_bars = settings["plot-generation"]["label_max_bars"]
+    if label_max_bars is not None and len(x_names) > label_max_bars:
+        # the labels would overlap anyway, and creating and drawing the ticks and labels of each bar takes most of the time
+        pdebug(f"plot_ranking: Not adding labels to the {len(x_names)} bars since there are more than label_max_bars={label_max_bars}", lvl=2)
+        ax.bar(x_positions, y_counts, color=colors)
+        ax.set_xticks([])
+    else:
+        ax.bar(x_positions, y_counts, tick_label="", color=colors)
+        if len(y_counts) > 0:
+            add_vertikal_labels_in_bar_plot(x_names, y_counts[-1], ax, x_positions, y_counts)
+            if settings["plot-generation"]["add_count_label"]: add_labels_at_top_of_bar(x_positions, y_counts, y_counts[-1], ax)
     # ax.ylabel(y_counts)
     return fig
 
@@ -143,7 +165,8 @@ def plot_ranking(ranking: list[tuple[int or float, str]], fig=None, xlabel="", y
 
 class Plot2Y:
     def __init__(self, xlabel, ylabel_left, ylabel_right, grid="major", rotate_xlabel=0, figsize=None):
-        self.fig, self.ax1 = plt.subplots(figsize=figsize, dpi=settings["plot-generation"]["dpi"], linewidth=1.0, frameon=True, subplotpars=None, layout=None)
+        self.plt = get_pyplot()
+        self.fig, self.ax1 = self.plt.subplots(figsize=figsize, dpi=settings["plot-generation"]["dpi"], linewidth=1.0, frameon=True, subplotpars=None, layout=None)
         self.ax1.set_xlabel(xlabel=xlabel) #, ylabel=ylabel_left)
         self.ax1.set_ylabel(ylabel=ylabel_left) #, ylabel=ylabel_left)
         self.ax2 = self.ax1.twinx()
@@ -162,7 +185,7 @@ class Plot2Y:
         # if label1 or label2: ax1.legend()
         if self.plots: self.plots += plot
         else: self.plots = plot
-        plt.legend(self.plots, [ l.get_label() for l in self.plots ])
+        self.plt.legend(self.plots, [ l.get_label() for l in self.plots ])
 
 
     def plot_left(self, xdata, ydata, label="", linestyle="-", marker="", color="blue"):
@@ -175,6 +198,83 @@ class Plot2Y:
         return self.fig
 
 
+def plot_history(date_names: list[str], history: dict[str, list[int]], track_human_visitors: bool, track_new_visitors: bool, figsize=None):
+    """
+    plot the visitor count on the left and the request count on the right axis
+    """
+    plt_history = Plot2Y(xlabel="Date", ylabel_left="Visitor count", ylabel_right="Request count", rotate_xlabel=-45, figsize=figsize)
+    # visitors, plot on correct order
+    plt_history.plot_left(date_names, history["visitors"], label="Unique visitors", color=color_settings_history["visitors"])
+    if track_human_visitors:
+        plt_history.plot_left(date_names, history["visitors_human"], label="Unique visitors (human)", color=color_settings_history["visitors_human"])
+    if track_new_visitors:
+        plt_history.plot_left(date_names, history["visitors_new"], label="Unique visitors (new)", color=color_settings_history["visitors_new"])
+    # requests
+    plt_history.plot_right(date_names, history["requests"], label="Unique requests", color=color_settings_history["requests"])
+    if track_human_visitors:
+        plt_history.plot_right(date_names, history["requests_human"], label="Unique requests (human)", color=color_settings_history["requests_human"])
+    if track_new_visitors:
+        plt_history.plot_right(date_names, history["requests_new"], label="Unique requests (new)", color=color_settings_history["requests_new"])
+    return plt_history.get_fig()
+
+
+#
+# RENDERING
+#
+class RenderTask(NamedTuple):
+    """
+    A plot that can be rendered without the database, eg in another process
+    plot_function(**kwargs) has to return the figure, which is saved as filename
+    """
+    filename: str
+    plot_function: Callable
+    kwargs: dict
+
+def render(task: RenderTask):
+    pdebug(f"render: Saving plot as '{task.filename}'")
+    fig = task.plot_function(**task.kwargs)
+    fig.savefig(task.filename, bbox_inches="tight")
+    # otherwise pyplot keeps a reference to every figure
+    get_pyplot().close(fig)
+
+
+class PlotRenderer:
+    """
+    Render plots in a pool of jobs processes, so that they are rendered in parallel to each other and to the database queries.
+    If jobs is 1, the plots are rendered immediately in this process.
+    The pool is only started when the first plot is rendered, so nothing is started if all plots are unchanged.
+    """
+    def __init__(self, jobs: int):
+        if jobs == 0: jobs = cpu_count() or 1
+        self.jobs = jobs
+        self.pool = None
+        self.pending = []
+
+    def render(self, task: RenderTask):
+        if self.jobs == 1:
+            render(task)
+            return
+        if self.pool is None:
+            pdebug(f"PlotRenderer: Rendering plots with {self.jobs} processes", lvl=2)
+            # the plot functions need the dpi and the other plot settings from the loaded settings
+            self.pool = Pool(self.jobs, initializer=init_worker_settings, initargs=(settings,))
+        self.pending.append(self.pool.apply_async(render, (task,)))
+
+    def finish(self):
+        """
+        wait until all plots are saved
+        @raises: the first exception that occured while rendering
+        """
+        if self.pool is None: return
+        try:
+            for result in self.pending:
+                result.get()
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pending.clear()
+
+
 #
 # MAIN
 #
@@ -205,6 +305,8 @@ def visualize(db: Database):
     pdebug(f"visualize: data_out_dir='{data_out_dir}', filetype='{data_filetype}'", lvl=2)
     if not data_out_dir:
         pdebug(f"visualize: Not exporting data since data_out_dir is None", lvl=1)
+    elif data_filetype not in table_writers:
+        error(f"visualize: Unsupported data filetype: '{data_filetype}', supported are: {', '.join(table_writers.keys())}")
 
     if not data_out_dir and not img_out_dir:
         warning(f"data_out_dir and img_out_dir are both None. No data will be exported and no plots will be generated!")
@@ -226,7 +328,7 @@ def visualize(db: Database):
         "mobile_visitor_percentage_total": "NaN",
         "mobile_visitor_percentage_last_x_days": "NaN",
         # general
-        "regina_version":   settings["regina"]["version"],
+        "regina_version":   get_version(),
         "server_name":      settings["regina"]["server_name"],
         "last_x_days":      settings["data-visualization"]["last_x_days"],
         "earliest_date":    "1990-1-1",
@@ -246,7 +348,7 @@ def visualize(db: Database):
     html_variables["earliest_date"] = dt.fromtimestamp(earliest_timestamp).strftime("%Y-%m-%d")
     html_variables["generation_date"] = dt.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    todos: list[tuple[str, tuple[int, int], list[str], list[str], list[tuple[int, int]]]] = []  # suffix, whole_time_timestamps, history_date_constraints, history_date_names, history_date_timestamps
+    todos: list[tuple[str, tuple[int, int], tuple[int, int], str]] = []  # suffix, whole_time_timestamps, history_timestamps, history_date_format
     task_nr = 1
     task_total = 0
     tasks_per_suffix = 9
@@ -256,64 +358,47 @@ def visualize(db: Database):
     if total:
         task_total += tasks_per_suffix
         all_time_timestamps = (0, now_stamp)
-        # all months in yyyy-mm format
-        month_names = db.get_months_where(get_date_constraint(min_date=0))
-        month_timestamps = []
-        # sqlite constrict to month string
-        month_constraints = []
-        for year_month in month_names:
-            year, month = year_month.split("-")
-            # timestamp of first day of the month
-            min_date  = int(dt(int(year), int(month), 1).timestamp())
-            month = (int(month) % 12) + 1  # + 1 month
-            year = int(year)
-            # first day of the next month - 1 sec
-            if month == 1: year += 1
-            max_date = int(dt(year, month, 1).timestamp()) - 1
-            month_constraints.append(get_date_constraint(min_date=min_date, max_date=max_date))
-            month_timestamps.append((min_date, max_date))
-        todos.append(("total", all_time_timestamps, month_constraints, month_names, month_timestamps))
+        # monthly history in yyyy-mm format
+        todos.append(("total", all_time_timestamps, all_time_timestamps, "%Y-%m"))
 
     last_x_days: int = settings["data-visualization"]["last_x_days"]
     if last_x_days > 0:
         task_total += tasks_per_suffix
         secs_per_day   = 86400
         last_x_days_min_date      = db.get_latest_timestamp() - last_x_days * secs_per_day
-        last_x_days_timestamps = (last_x_days_min_date, now_stamp)
-        last_x_days_constraint    = get_date_constraint(min_date=last_x_days_min_date)
-        days                = db.get_days_where(last_x_days_constraint)  # yyyy-mm-dd
-        day_constrains      = [ get_date_constraint(at_date=day) for day in days ]
-        day_timestamps  = []
-        for day in days:
-            year, month, day = day.split("-")
-            min_date  = int(dt(int(year), int(month), int(day)).timestamp())
-            max_date = min_date + secs_per_day
-            day_timestamps.append((min_date, max_date))
-
-        todos.append(("last_x_days", last_x_days_timestamps, day_constrains, days, day_timestamps))
+        # the statistics are computed from daily rollups, so start at the beginning of the first day
+        first_day = dt.fromtimestamp(last_x_days_min_date).replace(hour=0, minute=0, second=0, microsecond=0)
+        last_x_days_timestamps = (int(first_day.timestamp()), now_stamp)
+        # daily history in yyyy-mm-dd format
+        todos.append(("last_x_days", last_x_days_timestamps, last_x_days_timestamps, "%Y-%m-%d"))
 
-    def export_ranking(name: str, column_name: str, ranking: list[tuple[int or float, str]]):
+    if img_out_dir:
+        task_total += 1  # waiting for the plots
+
+    render_cache = RenderCache(f"{cache_dir}/render_cache.json") if settings["data-visualization"]["render_cache"] else None
+
+    def export_table(name: str, columns: tuple[str, ...], rows: list[tuple]):
         filename = f"{data_out_dir}/{name}.{data_filetype}"
-        if data_filetype == "pkl":
-            pdebug(f"visualize: Exporting {name} as pickle to '{filename}'", lvl=2)
-            with open(filename, "wb") as file:
-                dump(ranking, file)
-        elif data_filetype == "csv":
-            pdebug(f"visualize: Exporting {name} as csv to '{filename}'", lvl=2)
-            s = f'"{name}"\n'
-            s += f'"count","{column_name}"\n'
-            for count, item in ranking:
-                s += f'{count},"{item}"\n'
-            s = s.strip("\n")
-            with open(filename, "w") as file:
-                file.write(s)
-        else:
-            error(f"visualize: Unsupported data filetype: '{data_filetype}'")
-
-    def savefig(name: str, figure):
+        if render_cache and not render_cache.needs_update(filename, RenderCache.get_hash(columns, rows)): return
+        pdebug(f"visualize: Exporting {name} as {data_filetype} to '{filename}'", lvl=2)
+        with table_writers[data_filetype](filename, name, columns) as writer:
+            writer.write_rows(rows)
+
+    def export_ranking(name: str, column_name: str, ranking: list[tuple[int or float, str]]):
+        export_table(name, ("count", column_name), ranking)
+
+    renderer = PlotRenderer(settings["plot-generation"]["jobs"]) if img_out_dir else None
+    # everything besides the arguments of the plot function that changes how the plots look
+    plot_settings = (
+        get_version(),
+        version("matplotlib"),
+        { key: value for key, value in settings["plot-generation"].items() if key not in ["img_out_dir", "jobs"] },
+        settings["rankings"]["route_plot_max_routes"],
+    )
+    def savefig(name: str, plot_function: Callable, **kwargs):
         filename = f"{img_out_dir}/{name}.{img_filetype}"
-        pdebug(f"visualize: Saving plot for {name} as '{filename}'")
-        figure.savefig(filename, bbox_inches="tight")  # bboximg_inches="tight"
+        if render_cache and not render_cache.needs_update(filename, RenderCache.get_hash(plot_function.__qualname__, kwargs, plot_settings)): return
+        renderer.render(RenderTask(filename, plot_function, kwargs))
 
 
     def pprogress(*args):
@@ -322,8 +407,7 @@ def visualize(db: Database):
         task_nr += 1
 
     pdebug(f"visualize: total={total}, last_x_days={last_x_days}", lvl=3)
-    for suffix, whole_timespan_timestamps, single_date_constraints, single_date_names, single_date_timestamps in todos:
-        assert(len(single_date_names) == len(single_date_constraints))
+    for suffix, whole_timespan_timestamps, history_timestamps, history_date_format in todos:
         pdebug(f"visualize: {suffix} getting request and visitor history", lvl=2)
 
 
@@ -349,34 +433,13 @@ def visualize(db: Database):
 
         pprogress("Generating visitor+request history")
         # HISTORY
-        date_count = len(single_date_constraints)
-        visitor_count_dates = [ h.get_visitor_count_between(db, single_date_timestamps[i], only_human=False) for i in range(date_count) ]
-        request_count_dates = [ h.get_request_count_between(db, single_date_timestamps[i], only_human=False) for i in range(date_count) ]
-
-        visitor_count_human_dates = [ h.get_visitor_count_between(db, single_date_timestamps[i], only_human=True) for i in range(date_count) ]
-        request_count_human_dates = [ h.get_request_count_between(db, single_date_timestamps[i], only_human=True) for i in range(date_count) ]
-
-        visitor_count_new_dates = [ h.get_new_visitor_count_between(db, single_date_timestamps[i]) for i in range(date_count) ]
-        request_count_new_dates = [ h.get_request_from_new_visitor_count_between(db, single_date_timestamps[i]) for i in range(date_count) ]
+        date_names, history = h.get_history(db, history_timestamps, date_format=history_date_format)
 
         if img_out_dir:
-            plt_history = Plot2Y(xlabel="Date", ylabel_left="Visitor count", ylabel_right="Request count", rotate_xlabel=-45, figsize=settings["plot-generation"]["size_broad"])
-            # visitors, plot on correct order
-            plt_history.plot_left(single_date_names, visitor_count_dates, label="Unique visitors", color=color_settings_history["visitors"])
-            if get_humans_visitors:
-                plt_history.plot_left(single_date_names, visitor_count_human_dates, label="Unique visitors (human)", color=color_settings_history["visitors_human"])
-            if get_new_visitors:
-                plt_history.plot_left(single_date_names, visitor_count_new_dates, label="Unique visitors (new)", color=color_settings_history["visitors_new"])
-            # requests
-            plt_history.plot_right(single_date_names, request_count_dates, label="Unique requests", color=color_settings_history["requests"])
-            if get_humans_visitors:
-                plt_history.plot_right(single_date_names, request_count_human_dates, label="Unique requests (human)", color=color_settings_history["requests_human"])
-            if get_new_visitors:
-                plt_history.plot_right(single_date_names, request_count_new_dates, label="Unique requests (new)", color=color_settings_history["requests_new"])
-
-            savefig(f"history_visitor_request_{suffix}", plt_history.get_fig())
-        # if data_out_dir:  # TODO export history
-        #     s = ""
+            savefig(f"history_visitor_request_{suffix}", plot_history, date_names=date_names, history=history,
+                    track_human_visitors=get_humans_visitors, track_new_visitors=get_new_visitors, figsize=settings["plot-generation"]["size_broad"])
+        if data_out_dir:
+            export_table(f"history_visitor_request_{suffix}", ("date", *history.keys()), list(zip(date_names, *history.values())))
 
         # ROUTES
         pprogress("Generating route ranking")
@@ -384,8 +447,7 @@ def visualize(db: Database):
         route_ranking = route_ranking_group_routes(route_ranking)
         pdebug("visualize: route ranking", route_ranking, lvl=3)
         if img_out_dir:
-            fig_file_ranking = plot_ranking(route_ranking, xlabel="Route", ylabel="Number of requests", color_settings=color_settings_filetypes, figsize=settings["plot-generation"]["size_broad"])
-            savefig(f"ranking_route_{suffix}", fig_file_ranking)
+            savefig(f"ranking_route_{suffix}", plot_ranking, ranking=route_ranking, xlabel="Route", ylabel="Number of requests", color_settings=color_settings_filetypes, figsize=settings["plot-generation"]["size_broad"])
         if data_out_dir:
             export_ranking(f"ranking_route_{suffix}", "route", route_ranking)
 
@@ -396,8 +458,7 @@ def visualize(db: Database):
         cleanup_referer_ranking(referer_ranking)
         pdebug("visualize: referer ranking", referer_ranking, lvl=3)
         if img_out_dir:
-            fig_referer_ranking = plot_ranking(referer_ranking, xlabel="HTTP Referer", ylabel="Number of requests", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
-            savefig(f"ranking_referer_{suffix}", fig_referer_ranking)
+            savefig(f"ranking_referer_{suffix}", plot_ranking, ranking=referer_ranking, xlabel="HTTP Referer", ylabel="Number of requests", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
         if data_out_dir:
             export_ranking(f"ranking_referer_{suffix}", "referer", referer_ranking)
 
@@ -407,8 +468,7 @@ def visualize(db: Database):
             country_ranking = get_country_ranking(db, whole_timespan_timestamps, only_human=settings["rankings"]["geoip_only_humans"])
             pdebug("visualize: country ranking:", country_ranking, lvl=3)
             if img_out_dir:
-                fig_referer_ranking = plot_ranking(country_ranking, xlabel="Country", ylabel="Number of visitors", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
-                savefig(f"ranking_country_{suffix}", fig_referer_ranking)
+                savefig(f"ranking_country_{suffix}", plot_ranking, ranking=country_ranking, xlabel="Country", ylabel="Number of visitors", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
             if data_out_dir:
                 export_ranking(f"ranking_country_{suffix}", "country", country_ranking)
 
@@ -416,8 +476,7 @@ def visualize(db: Database):
             city_ranking = get_city_ranking(db, whole_timespan_timestamps, add_country_code=settings["rankings"]["city_add_country_code"], only_human=settings["rankings"]["geoip_only_humans"])
             pdebug("visualize: city ranking:", city_ranking, lvl=3)
             if img_out_dir:
-                fig_referer_ranking = plot_ranking(city_ranking, xlabel="City", ylabel="Number of visitors", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
-                savefig(f"ranking_city_{suffix}", fig_referer_ranking)
+                savefig(f"ranking_city_{suffix}", plot_ranking, ranking=city_ranking, xlabel="City", ylabel="Number of visitors", color_settings=color_settings_alternate, figsize=settings["plot-generation"]["size_broad"])
             if data_out_dir:
                 export_ranking(f"ranking_city_{suffix}", "city", city_ranking)
 
@@ -426,8 +485,7 @@ def visualize(db: Database):
         platform_ranking = get_platform_ranking(db, whole_timespan_timestamps, only_human=False)
         platform_ranking = make_ranking_relative(platform_ranking)
         if img_out_dir:
-            fig_os_rating = plot_ranking(platform_ranking, xlabel="Platform", ylabel="Share [%]", color_settings=color_settings_platforms, figsize=settings["plot-generation"]["size_narrow"])
-            savefig(f"ranking_platform_{suffix}", fig_os_rating)
+            savefig(f"ranking_platform_{suffix}", plot_ranking, ranking=platform_ranking, xlabel="Platform", ylabel="Share [%]", color_settings=color_settings_platforms, figsize=settings["plot-generation"]["size_narrow"])
         if data_out_dir:
             export_ranking(f"ranking_platform_{suffix}", "platform", platform_ranking)
 
@@ -437,11 +495,16 @@ def visualize(db: Database):
         browser_ranking = make_ranking_relative(browser_ranking)
         pdebug("visualize: browser ranking:", browser_ranking, lvl=3)
         if img_out_dir:
-            fig_browser_rating = plot_ranking(browser_ranking, xlabel="Browser", ylabel="Share [%]", color_settings=color_settings_browsers, figsize=settings["plot-generation"]["size_narrow"])
-            savefig(f"ranking_browser_{suffix}", fig_browser_rating)
+            savefig(f"ranking_browser_{suffix}", plot_ranking, ranking=browser_ranking, xlabel="Browser", ylabel="Share [%]", color_settings=color_settings_browsers, figsize=settings["plot-generation"]["size_narrow"])
         if data_out_dir:
             export_ranking(f"ranking_browser_{suffix}", "browser", browser_ranking)
 
+    if renderer:
+        pprogress("Waiting for the plots")
+        renderer.finish()
+    if render_cache:
+        render_cache.save()
+        pdebug(f"visualize: Skipped {render_cache.skipped_count} unchanged plots and data files", lvl=1)
 
     html_variables_str = dict_str(html_variables).replace('\n', '\n\t')
     pdebug(f"visualize: html_variables:\n\t{html_variables_str}", lvl=1)
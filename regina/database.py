@@ -2,9 +2,9 @@
 import sqlite3 as sql
 from csv import reader
 from os import path, listdir
-import pkg_resources
 import re
 from datetime import datetime as dt
+from typing import Iterable
 
 if __name__ == "__main__":  # make relative imports work as described here: https://peps.python.org/pep-0366/#proposed-change
     if __package__ is None:
@@ -15,40 +15,116 @@ if __name__ == "__main__":  # make relative imports work as described here: http
         sys.path.insert(0, path.dirname(path.dirname(filepath)))
 
 # local
-from regina.utility.sql_util import replace_null, sanitize, sql_select, sql_exists, sql_tablesize
-from regina.utility.utility import pdebug, get_filepath, warning, pmessage, is_blacklisted, is_whitelisted
+from regina.utility.sql_util import replace_null, sanitize, sql_select, sql_exists, sql_tablesize, sql_max, sql_max_variables, QueryExplainer
+from regina.utility.utility import pdebug, get_filepath, warning, pmessage, is_blacklisted, is_whitelisted, batched, get_filter
 from regina.utility.globals import settings
-from regina.data_collection.request import Request
+from regina.data_collection.request import Request, RequestBatch
+from regina.data_collection.user_agent import UserAgentCache
 from regina.utility.globals import user_agent_platforms, user_agent_browsers, settings
+from regina.utility.cache import IdCache
+from regina.utility.geoip import IpRangeIndex
 
 """
 create reginas database as shown in the uml diagram database.uxf
 """
 
+# PRAGMAs that are set when the database is opened, see the database section of the config
+pragma_profiles: dict[str, dict[str, str|int]] = {
+    "fast": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -64 * 1024,   # KiB
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+    },
+    "safe": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+    },
+    "sqlite": {},
+}
+pragma_names = ["journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store"]
+
 class Database:
     def __init__(self, database_path):
-        self.conn = sql.connect(database_path)
+        self.database_path = database_path
+        self.conn = sql.connect(database_path, timeout=settings["database"]["busy_timeout"] / 1000)
+        # prints the query plans if enabled, see explain_queries
+        self.query_explainer: QueryExplainer|None = None
         self.cur = self.conn.cursor()
+        self.set_pragmas()
         # verify that the database is created
         self.cur.execute("pragma schema_version")
         if self.cur.fetchone()[0] == 0:  # not created
             pdebug(f"Database.__init__: Creating new databse at {database_path}", lvl=1)
-            with open(pkg_resources.resource_filename("regina", "sql/create_db.sql"), "r") as file:
-                create_db = file.read()
-            self.cur.executescript(create_db)
-            self.conn.commit()
         else:
             pdebug(f"Database.__init__: Opening existing database at {database_path}", lvl=1)
+        self.create_tables()
+        # name <-> id caches, see _get_id_cache
+        self.id_caches: dict[str, IdCache] = {}
+        # PRAGMA data_version when the caches were last checked, see _check_data_version
+        self.data_version: int = self("PRAGMA data_version")[0][0]
+        # sorted ip ranges, see _get_ip_range_index
+        self.ip_range_index: IpRangeIndex|None = None
+        # platform, browser etc. of user agents
+        self.user_agent_cache = UserAgentCache(settings["data-collection"]["user_agent_cache_size"] or None)
+        # local dates of 15 minute intervals, see get_date
+        self.date_cache: dict[int, str] = {}
+        # fill the rollup tables of databases created by older versions
+        if self("SELECT EXISTS (SELECT 1 FROM request) AND NOT EXISTS (SELECT 1 FROM visitor_day)")[0][0] == 1:
+            self.rebuild_rollups()
+
+    def set_pragmas(self):
+        """
+        set the PRAGMAs of the profile from the settings, single PRAGMAs can be overridden in the settings
+        """
+        profile = settings["database"]["profile"]
+        if profile not in pragma_profiles:
+            warning(f"Database: Unknown profile '{profile}', using 'fast'. Available profiles: {', '.join(pragma_profiles.keys())}")
+            profile = "fast"
+        pragmas = pragma_profiles[profile].copy()
+        for name in pragma_names:
+            if settings["database"][name] is not None:
+                pragmas[name] = settings["database"][name]
+        for name, value in pragmas.items():
+            if type(value) == str and not re.fullmatch(r"\w+", value):
+                warning(f"Database: Invalid value for PRAGMA {name}: '{value}'")
+                continue
+            self.cur.execute(f"PRAGMA {name} = {value}")
+            if name == "journal_mode":
+                # returns the new journal mode, which stays the same if it can not be changed
+                journal_mode = self.cur.fetchone()[0]
+                if journal_mode != str(value).lower():
+                    warning(f"Database: Could not set PRAGMA journal_mode = {value}, the journal_mode is '{journal_mode}'")
+        pdebug(f"Database.set_pragmas: profile={profile}: {pragmas}", lvl=2)
+
+    def create_tables(self):
+        """
+        create all tables and indexes from create_db.sql
+        all statements are 'IF NOT EXISTS', so this also adds tables and indexes that are missing in databases created by older versions
+        """
+        # imported here, because importing it takes long and it is not needed when regina is only imported
+        from importlib.resources import files
+        create_db = files("regina").joinpath("sql/create_db.sql").read_text()
+        self.cur.executescript(create_db)
+        self.conn.commit()
+
+    def explain_queries(self):
+        """
+        print the EXPLAIN QUERY PLAN of all queries that are executed from now on, see QueryExplainer
+        """
+        self.query_explainer = QueryExplainer(self.database_path)
+        self.conn.set_trace_callback(self.query_explainer)
 
     def __del__(self):
         self.cur.close()
         self.conn.commit()
         self.conn.close()
 
-    def __call__(self, s):
+    def __call__(self, s, params=()):
         """execute a command and return fetchall()"""
-        pdebug(f"Database: execute: \"{s}\"", lvl=4)
-        self.cur.execute(s)
+        pdebug(f"Database: execute: \"{s}\", params={params}", lvl=4)
+        self.cur.execute(s, params)
         return self.cur.fetchall()
     def execute(self, s):
         self.cur.execute(s)
@@ -99,6 +175,56 @@ class Database:
         self.cur.execute(f"UPDATE visitor SET is_human = 1 WHERE visitor_id = {visitor_id}")
         return True
 
+    def _get_visitor_key(self, ip_address: int, browser_id: int, platform_id: int) -> tuple:
+        """
+        the key that identifies a unique visitor
+        """
+        if settings["data-collection"]["unique_visitor_is_ip_address"]:
+            return (ip_address,)
+        return (ip_address, browser_id, platform_id)
+
+    def _get_visitor_cache(self) -> IdCache:
+        """
+        get the visitor key -> visitor_id cache
+        if the visitor table is small enough, all visitors are loaded at once
+        """
+        if "visitor" not in self.id_caches:
+            cache = IdCache("visitor", max_size=settings["data-collection"]["visitor_cache_size"] or None)
+            if cache.max_size is None or sql_tablesize(self.cur, "visitor") <= cache.max_size:
+                # descending order: if there are multiple matches for a key, the smallest visitor_id is used
+                for visitor_id, ip_address, browser_id, platform_id in self("SELECT visitor_id, ip_address, browser_id, platform_id FROM visitor ORDER BY visitor_id DESC"):
+                    cache.add(self._get_visitor_key(ip_address, browser_id, platform_id), visitor_id)
+                cache.complete = True
+            pdebug(f"_get_visitor_cache: Created {cache}", lvl=3)
+            self.id_caches["visitor"] = cache
+        return self.id_caches["visitor"]
+
+    def _get_visitor_ids(self, keys) -> dict[tuple, int]:
+        """
+        get the visitor_ids for the visitor keys, first from the cache, then from the database
+        keys of visitors that do not exist are not in the returned dict
+        """
+        cache = self._get_visitor_cache()
+        visitor_ids: dict[tuple, int] = {}
+        missing_ip_addresses = set()
+        for key in keys:
+            visitor_id = cache.get_id(key)
+            if visitor_id is None: missing_ip_addresses.add(key[0])
+            else: visitor_ids[key] = visitor_id
+        if missing_ip_addresses and not cache.complete:
+            missing_ip_addresses = list(missing_ip_addresses)
+            found: dict[tuple, int] = {}
+            for i in range(0, len(missing_ip_addresses), sql_max_variables):
+                chunk = missing_ip_addresses[i:i+sql_max_variables]
+                self.cur.execute(f"SELECT visitor_id, ip_address, browser_id, platform_id FROM visitor WHERE ip_address IN ({','.join('?' * len(chunk))}) ORDER BY visitor_id DESC", chunk)
+                for visitor_id, ip_address, browser_id, platform_id in self.cur.fetchall():
+                    found[self._get_visitor_key(ip_address, browser_id, platform_id)] = visitor_id
+            for key in keys:
+                if key in visitor_ids or key not in found: continue
+                visitor_ids[key] = found[key]
+                cache.add(key, found[key])
+        return visitor_ids
+
     def get_visitor_id(self, request: Request, insert=True) -> tuple[int | None, bool]:
         """
         get the visitor_id:
@@ -113,26 +239,25 @@ class Database:
         """
         ip_address = request.ip_address
 
+        user_agent = self.user_agent_cache.get(request.user_agent)
         # if insert == True, ids will be int
-        browser_id: int | None = self.get_id("browser", request.get_browser(), insert=insert)
-        platform_id: int | None = self.get_id("platform", request.get_platform(), insert=insert)
-        constraints = [("ip_address", ip_address)]
-        if not settings["data-collection"]["unique_visitor_is_ip_address"]:
-            if browser_id: constraints.append(("browser_id", browser_id))
-            if platform_id: constraints.append(("platform_id", platform_id))
-        is_new_visitor = False
-        if not sql_exists(self.cur, "visitor", constraints):
-            is_new_visitor = True
-            if not insert:
-                return None, False
-            is_mobile = int(request.get_mobile())
-            ip_range_id = 0
-            if settings["data-collection"]["get_visitor_location"]:
-                ip_range_id = self.get_ip_range_id(request.ip_address)
-            is_human = 0  # update_is_visitor_human cannot be called until visitor is in db
-            self.cur.execute(f"INSERT INTO visitor (ip_address, ip_range_id, platform_id, browser_id, is_mobile, is_human) VALUES ('{ip_address}', '{ip_range_id}', '{platform_id}', '{browser_id}', '{is_mobile}', '{is_human}');")
-        visitor_id = sql_select(self.cur, "visitor", constraints)[0][0]
-        return visitor_id, is_new_visitor
+        browser_id: int | None = self.get_id("browser", user_agent.browser, insert=insert)
+        platform_id: int | None = self.get_id("platform", user_agent.platform, insert=insert)
+        key = self._get_visitor_key(ip_address, browser_id, platform_id)
+        visitor_id = self._get_visitor_ids([key]).get(key)
+        if visitor_id is not None:
+            return visitor_id, False
+        if not insert:
+            return None, False
+        is_mobile = int(user_agent.is_mobile)
+        ip_range_id = 0
+        if settings["data-collection"]["get_visitor_location"]:
+            ip_range_id = self.get_ip_range_id(request.ip_address)
+        is_human = 0  # update_is_visitor_human cannot be called until visitor is in db
+        self.cur.execute("INSERT INTO visitor (ip_address, ip_range_id, platform_id, browser_id, is_mobile, is_human) VALUES (?, ?, ?, ?, ?, ?)", (ip_address, ip_range_id, platform_id, browser_id, is_mobile, is_human))
+        visitor_id = self.cur.lastrowid
+        self._get_visitor_cache().add(key, visitor_id)
+        return visitor_id, True
 
     def get_visitor_ids_for_date(self, date:str) -> list[int]:
         return [ visitor_id[0] for visitor_id in self(f"SELECT DISTINCT visitor_id FROM request WHERE {date}") ]
@@ -173,34 +298,270 @@ class Database:
         else:
             pdebug("add_request: added", request, lvl=3)
             self.cur.execute(f"INSERT INTO request (visitor_id, route_id, referer_id, time, status) VALUES ({visitor_id}, {route_id}, {referer_id}, {request.time_local}, {request.status})")
+            self._update_rollups([(visitor_id, route_id, referer_id, request.time_local, int(request.status))])
             return visitor_id, is_new_visitor
 
-    def add_requests(self, requests: list[Request]):
+    def add_requests(self, requests: Iterable[Request]):
         """
-        Add a list of requests to the database
+        Add requests to the database
         Adds the visitors, if needed
+        requests can be any iterable, eg a generator from parse_log.
+        They are processed in batches of 'batch_size', each batch is added in a single transaction.
+        @returs added_request_count, visitors_count, new_visitors_count
+        """
+        return self.add_request_batches(RequestBatch(batch) for batch in batched(requests, settings["data-collection"]["batch_size"]))
+
+    def add_request_batches(self, batches: Iterable[RequestBatch], log_checkpoints: Iterable[tuple[str, tuple[int, int, int, str]]]|None=None):
+        """
+        Add batches of requests to the database
+        Adds the visitors, if needed
+        batches can be any iterable, eg a generator from parse_byte_ranges.
+        Batches with more than 'batch_size' requests are split, each batch is added in a single transaction.
+        @param log_checkpoints: (logfile_path, checkpoint) for each batch, which is stored in the transaction of its last requests,
+            so that an interrupted run continues after the last committed batch
         @returs added_request_count, visitors_count, new_visitors_count
         """
         added_request_count = 0
-        # check the new visitors later
         visitors: set[int] = set()
         new_visitors: set[int] = set()
-        for i in range(len(requests)):
-            if     is_blacklisted(requests[i].route, settings["data-collection"]["request_route_blacklist"]): continue
-            if not is_whitelisted(requests[i].route, settings["data-collection"]["request_route_whitelist"]): continue
-            visitor_id, is_new_visitor = self.add_request(requests[i])
-            if visitor_id:
-                added_request_count += 1
-                visitors.add(visitor_id)
-                if is_new_visitor:
-                    new_visitors.add(visitor_id)
-
-        # update the is_human column for all new visitors
-        for visitor_id in new_visitors:
-            self.update_is_visitor_human(visitor_id)
+        # new visitors without a bot user agent, their is_human is updated whenever they have requests in a batch
+        human_candidates: set[int] = set()
+        route_filter = get_filter(settings["data-collection"]["request_route_blacklist"], settings["data-collection"]["request_route_whitelist"])
+        batch_size = settings["data-collection"]["batch_size"]
+        log_checkpoints = iter(log_checkpoints) if log_checkpoints is not None else None
+        for batches_ in batches:
+            log_checkpoint = next(log_checkpoints) if log_checkpoints is not None else None
+            split_batches = list(batches_.split(batch_size))
+            for j, batch in enumerate(split_batches):
+                allowed_routes = { route: route_filter(route) for route in dict.fromkeys(batch.route) }
+                if not all(allowed_routes.values()):
+                    batch = batch.select([ i for i, route in enumerate(batch.route) if allowed_routes[route] ])
+                if not self.conn.in_transaction:
+                    # lock the database for writing before the caches are checked, so that no other connection can add rows until the commit
+                    self.cur.execute("BEGIN IMMEDIATE")
+                try:
+                    self._check_data_version()
+                    batch_visitors: set[int] = set()
+                    added_request_count += self._add_request_batch(batch, batch_visitors, new_visitors, human_candidates)
+                    visitors.update(batch_visitors)
+                    # in the same transaction, so that the visitors of an interrupted run are not left without is_human
+                    self._update_is_human(batch_visitors & human_candidates)
+                    if log_checkpoint is not None and j == len(split_batches) - 1:
+                        self.set_log_checkpoint(*log_checkpoint, commit=False)
+                    self.conn.commit()
+                except:
+                    self.conn.rollback()
+                    raise
+                pdebug(f"add_requests: Committed batch of {len(batch)} requests", lvl=3)
+        self.print_id_cache_stats()
 
         return added_request_count, len(visitors), len(new_visitors)
 
+    def _get_ids(self, table: str, names: Iterable[str]) -> dict[str, int]:
+        """
+        get the ids of all names in table, names that are not in the table are inserted
+        @returns { name: id }
+        """
+        cache = self._get_id_cache(table)
+        ids: dict[str, int] = {}
+        missing = []
+        for name in names:
+            id_ = cache.get_id(name)
+            if id_ is None: missing.append(name)
+            else: ids[name] = id_
+        def select(names_: list[str]):
+            for i in range(0, len(names_), sql_max_variables):
+                chunk = names_[i:i+sql_max_variables]
+                self.cur.execute(f"SELECT name, {table}_id FROM {table} WHERE name IN ({','.join('?' * len(chunk))})", chunk)
+                for name, id_ in self.cur.fetchall():
+                    ids[name] = id_
+                    cache.add(name, id_)
+        if missing and not cache.complete:
+            select(missing)
+            missing = [ name for name in missing if name not in ids ]
+        if missing:
+            self.cur.executemany(f"INSERT INTO {table} (name) VALUES (?)", ((name,) for name in missing))
+            select(missing)
+        return ids
+
+    def _check_data_version(self):
+        """
+        if another connection, eg a --collect while --follow is running, committed since the last check,
+        the caches are marked as incomplete, so that names and visitors that are not cached are looked up in the database
+        """
+        self.cur.execute("PRAGMA data_version")
+        data_version = self.cur.fetchone()[0]
+        if data_version != self.data_version:
+            pdebug(f"Database: The database was changed by another connection, the caches are incomplete now", lvl=2)
+            for cache in self.id_caches.values():
+                cache.complete = False
+        self.data_version = data_version
+
+    def _update_is_human(self, visitor_ids: set[int]):
+        """
+        update the is_human column of new visitors that do not have a bot user agent
+        Called for the visitors of every batch, so that the requests of the later batches are taken into account
+        """
+        if settings["data-collection"]["human_needs_successful_request"]:
+            max_success_status = 400 if settings["data-collection"]["status_300_is_success"] else 300
+            self.cur.executemany("UPDATE visitor SET is_human = EXISTS (SELECT 1 FROM request WHERE visitor_id = ?1 AND status < ?2) WHERE visitor_id = ?1",
+                                 ((visitor_id, max_success_status) for visitor_id in visitor_ids))
+        else:
+            self.cur.executemany("UPDATE visitor SET is_human = 1 WHERE visitor_id = ?", ((visitor_id,) for visitor_id in visitor_ids))
+
+    def _add_request_batch(self, batch: RequestBatch, visitors: set[int], new_visitors: set[int], human_candidates: set[int]) -> int:
+        """
+        add a batch of requests using as few sql statements as possible
+        visitors, new_visitors and human_candidates are updated with the visitor_ids of this batch
+        @returns number of added requests
+        """
+        get_location = settings["data-collection"]["get_visitor_location"]
+        ignore_seconds = settings["data-collection"]["ignore_duplicate_requests_within_x_seconds"]
+
+        user_agents = { user_agent: self.user_agent_cache.get(user_agent) for user_agent in dict.fromkeys(batch.user_agent) }
+        # resolve all names to ids at once
+        # dict instead of set: new names are inserted in the order in which they appear
+        browser_ids  = self._get_ids("browser", dict.fromkeys(replace_null(user_agent.browser) for user_agent in user_agents.values()))
+        platform_ids = self._get_ids("platform", dict.fromkeys(replace_null(user_agent.platform) for user_agent in user_agents.values()))
+        referer_ids  = self._get_ids("referer", dict.fromkeys(map(replace_null, batch.referer)))
+        route_ids    = self._get_ids("route", dict.fromkeys(map(replace_null, batch.route)))
+
+        # visitors
+        keys = []
+        for ip_address, user_agent in zip(batch.ip_address, batch.user_agent):
+            user_agent = user_agents[user_agent]
+            keys.append(self._get_visitor_key(ip_address, browser_ids[replace_null(user_agent.browser)], platform_ids[replace_null(user_agent.platform)]))
+        batch_visitors = self._get_visitor_ids(dict.fromkeys(keys))
+        visitor_cache = self._get_visitor_cache()
+
+        next_visitor_id = sql_max(self.cur, "visitor", "visitor_id") + 1
+        batch_new_visitors: set[int] = set()
+        new_visitor_rows = []
+        visitor_ids = []
+        for ip_address, user_agent, key in zip(batch.ip_address, batch.user_agent, keys):
+            visitor_id = batch_visitors.get(key)
+            if visitor_id is None:
+                visitor_id = next_visitor_id
+                next_visitor_id += 1
+                user_agent = user_agents[user_agent]
+                # ip_range_id is set below, is_human is set by _update_is_human
+                new_visitor_rows.append([visitor_id, ip_address, 0, platform_ids[replace_null(user_agent.platform)], browser_ids[replace_null(user_agent.browser)], int(user_agent.is_mobile), 0])
+                batch_new_visitors.add(visitor_id)
+                if not user_agent.is_bot:
+                    human_candidates.add(visitor_id)
+                batch_visitors[key] = visitor_id
+                visitor_cache.add(key, visitor_id)
+            visitor_ids.append(visitor_id)
+        if get_location:
+            ip_range_ids = self.get_ip_range_ids([ row[1] for row in new_visitor_rows ])
+            for row, ip_range_id in zip(new_visitor_rows, ip_range_ids):
+                row[2] = ip_range_id
+        self.cur.executemany("INSERT INTO visitor (visitor_id, ip_address, ip_range_id, platform_id, browser_id, is_mobile, is_human) VALUES (?, ?, ?, ?, ?, ?, ?)", new_visitor_rows)
+
+        # requests
+        request_rows = []
+        batch_request_times: dict[tuple[int, int], list[int]] = {}  # (visitor_id, route_id): [time]
+        for i, (visitor_id, route, referer, time, status) in enumerate(zip(visitor_ids, batch.route, batch.referer, batch.time_local, batch.status)):
+            route_id = route_ids[replace_null(route)]
+            time_min, time_max = max(0, time - ignore_seconds), time + ignore_seconds
+            # check if request is unique, first in this batch, then in the database
+            times = batch_request_times.setdefault((visitor_id, route_id), [])
+            if any(time_min <= t <= time_max for t in times):
+                pdebug("add_requests: exists:", batch[i], lvl=4)
+                continue
+            if visitor_id not in batch_new_visitors:
+                self.cur.execute("SELECT EXISTS (SELECT 1 FROM request WHERE visitor_id = ? AND route_id = ? AND time BETWEEN ? AND ?)", (visitor_id, route_id, time_min, time_max))
+                if self.cur.fetchone()[0] == 1:
+                    pdebug("add_requests: exists:", batch[i], lvl=4)
+                    continue
+            times.append(time)
+            request_rows.append((visitor_id, route_id, referer_ids[replace_null(referer)], time, status))
+            visitors.add(visitor_id)
+        self.cur.executemany("INSERT INTO request (visitor_id, route_id, referer_id, time, status) VALUES (?, ?, ?, ?, ?)", request_rows)
+        self._update_rollups(request_rows)
+        new_visitors.update(batch_new_visitors)
+        return len(request_rows)
+
+    #
+    # ROLLUPS
+    #
+    def get_date(self, timestamp: int) -> str:
+        """
+        get the local date of a unixepoch timestamp in yyyy-mm-dd format
+        all timezone offsets are multiples of 15 minutes, so the date is cached per 15 minute interval
+        """
+        interval = timestamp // 900
+        date = self.date_cache.get(interval)
+        if date is None:
+            date = dt.fromtimestamp(interval * 900).strftime("%Y-%m-%d")
+            self.date_cache[interval] = date
+        return date
+
+    def _update_rollups(self, request_rows: list[tuple[int, int, int, int, int]]):
+        """
+        add requests to the daily rollup tables
+        @param request_rows: [(visitor_id, route_id, referer_id, time, status)] of the requests that were added to the request table
+        """
+        visitor_days: dict[tuple[str, int], int] = {}
+        route_days: dict[tuple[str, int, int], int] = {}
+        referer_days: dict[tuple[str, int], int] = {}
+        for visitor_id, route_id, referer_id, time, status in request_rows:
+            date = self.get_date(time)
+            key = (date, visitor_id)
+            visitor_days[key] = visitor_days.get(key, 0) + 1
+            key = (date, route_id, status)
+            route_days[key] = route_days.get(key, 0) + 1
+            key = (date, referer_id)
+            referer_days[key] = referer_days.get(key, 0) + 1
+        self.cur.executemany("""INSERT INTO visitor_day (date, visitor_id, request_count) VALUES (?, ?, ?)
+            ON CONFLICT(date, visitor_id) DO UPDATE SET request_count = request_count + excluded.request_count""",
+            ((*key, count) for key, count in visitor_days.items()))
+        self.cur.executemany("""INSERT INTO route_day (date, route_id, status, request_count) VALUES (?, ?, ?, ?)
+            ON CONFLICT(date, route_id, status) DO UPDATE SET request_count = request_count + excluded.request_count""",
+            ((*key, count) for key, count in route_days.items()))
+        self.cur.executemany("""INSERT INTO referer_day (date, referer_id, request_count) VALUES (?, ?, ?)
+            ON CONFLICT(date, referer_id) DO UPDATE SET request_count = request_count + excluded.request_count""",
+            ((*key, count) for key, count in referer_days.items()))
+
+    def rebuild_rollups(self):
+        """
+        recompute all rollup tables from the request table
+        """
+        pmessage("Building the daily rollup tables, this might take a while...")
+        self.cur.execute("BEGIN")
+        try:
+            self.cur.execute("DELETE FROM visitor_day")
+            self.cur.execute("DELETE FROM route_day")
+            self.cur.execute("DELETE FROM referer_day")
+            self.cur.execute("""INSERT INTO visitor_day (date, visitor_id, request_count)
+                SELECT DATE(time, 'unixepoch', 'localtime') AS date, visitor_id, COUNT(*) FROM request GROUP BY date, visitor_id""")
+            self.cur.execute("""INSERT INTO route_day (date, route_id, status, request_count)
+                SELECT DATE(time, 'unixepoch', 'localtime') AS date, route_id, status, COUNT(*) FROM request GROUP BY date, route_id, status""")
+            self.cur.execute("""INSERT INTO referer_day (date, referer_id, request_count)
+                SELECT DATE(time, 'unixepoch', 'localtime') AS date, referer_id, COUNT(*) FROM request GROUP BY date, referer_id""")
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+
+
+    def _get_id_cache(self, table: str) -> IdCache:
+        """
+        get the name <-> id cache for table
+        the cache is created when a table is first used. If the table is small enough, all rows are loaded at once.
+        """
+        if table not in self.id_caches:
+            max_size = None
+            if table in ["referer", "route"]:
+                max_size = settings["data-collection"]["referer_route_cache_size"] or None
+            cache = IdCache(table, max_size=max_size)
+            if max_size is None or sql_tablesize(self.cur, table) <= max_size:
+                for id_, name in self(f"SELECT {table}_id, name FROM {table}"):
+                    cache.add(name, id_)
+                cache.complete = True
+            pdebug(f"_get_id_cache: Created {cache}", lvl=3)
+            self.id_caches[table] = cache
+        return self.id_caches[table]
 
     def get_id(self, table: str, name: str, insert=True) -> int | None:
         """
@@ -212,13 +573,23 @@ class Database:
         """
         supported_tables = ["platform", "browser", "referer", "route", "city"]
         if not table in supported_tables: raise ValueError(f"table '{table}' is not supported ({supported_tables})")
-        name = sanitize(replace_null(name))
-        # if non existent, add name
+        name = replace_null(name).strip(" ")
         pdebug(f"get_id(table={table},\tname={name}", lvl=4)
-        if not sql_exists(self.cur, table, [("name", name)], do_sanitize=False):  # double sanitizing might lead to problems with quotes
-            if not insert: return None
-            self.cur.execute(f"INSERT INTO {table} (name) VALUES ('{name}')")
-        return self(f"SELECT {table}_id FROM {table} WHERE name = '{name}'")[0][0]
+        cache = self._get_id_cache(table)
+        id_ = cache.get_id(name)
+        if id_ is not None: return id_
+        if not cache.complete:
+            self.cur.execute(f"SELECT {table}_id FROM {table} WHERE name = ?", (name,))
+            result = self.cur.fetchone()
+            if result is not None:
+                cache.add(name, result[0])
+                return result[0]
+        # if non existent, add name
+        if not insert: return None
+        self.cur.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,))
+        id_ = self.cur.lastrowid
+        cache.add(name, id_)
+        return id_
 
     def get_name(self, table: str, id_: int) -> (str | None):
         """
@@ -228,26 +599,61 @@ class Database:
         """
         supported_tables = ["platform", "browser", "referer", "route", "city"]
         if not table in supported_tables: raise ValueError(f"table '{table}' is not supported ({supported_tables})")
+        cache = self._get_id_cache(table)
+        name = cache.get_name(id_)
+        if name is not None or cache.complete: return name
         ret = self(f"SELECT name FROM {table} WHERE {table}_id = '{id_}'")
         if len(ret) == 0: return None
+        cache.add(ret[0][0], id_)
         return ret[0][0]
 
+    def print_id_cache_stats(self, lvl=2):
+        for cache in self.id_caches.values():
+            pdebug(f"Database: {cache}", lvl=lvl)
+        pdebug(f"Database: {self.user_agent_cache}", lvl=lvl)
+
+
+
+    #
+    # LOG CHECKPOINT
+    #
+    def get_log_checkpoint(self, logfile_path: str) -> tuple[int, int, int, str] | None:
+        """
+        get the checkpoint (inode, device, offset, last_line_hash) for the logfile
+        if the logfile has not been collected yet, returns None
+        """
+        self.cur.execute("SELECT inode, device, offset, last_line_hash FROM log_checkpoint WHERE path = ?", (path.realpath(logfile_path),))
+        return self.cur.fetchone()
+
+    def set_log_checkpoint(self, logfile_path: str, checkpoint: tuple[int, int, int, str], commit=True):
+        """
+        store the checkpoint (inode, device, offset, last_line_hash) for the logfile
+        @param commit: if False, the checkpoint is committed with the current transaction
+        """
+        self.cur.execute("INSERT OR REPLACE INTO log_checkpoint (path, inode, device, offset, last_line_hash) VALUES (?, ?, ?, ?, ?)", (path.realpath(logfile_path), *checkpoint))
+        if commit: self.conn.commit()
 
 
     #
     # GEOIP
     #
+    def _get_ip_range_index(self) -> IpRangeIndex:
+        """
+        get the sorted ip ranges, they are loaded from the database when first used
+        """
+        if self.ip_range_index is None:
+            self.ip_range_index = IpRangeIndex(self("SELECT low, high, ip_range_id FROM ip_range ORDER BY low"))
+            pdebug(f"_get_ip_range_index: Loaded {len(self.ip_range_index)} ip ranges", lvl=2)
+        return self.ip_range_index
+
     def get_ip_range_id(self, ip_address: int) -> int:
-        results = self(f"SELECT ip_range_id FROM ip_range WHERE '{ip_address}' BETWEEN low AND high")
-        ip_range_id_val = 0
-        if len(results) == 0:
-            pass
-        elif len(results) > 1:
-            warning(f"get_ip_range_id: Found multiple ip_ranges for ip_address={ip_address}: results={results}")
-        else:
-            ip_range_id_val = results[0][0]
-        return ip_range_id_val
+        return self._get_ip_range_index().get(ip_address)
 
+    def get_ip_range_ids(self, ip_addresses: list[int]) -> list[int]:
+        """
+        get the ip_range_ids for a list of ip addresses
+        """
+        return self._get_ip_range_index().get_many(ip_addresses)
 
     def update_ip_range_id(self, visitor_id: int):
         """
@@ -263,6 +669,18 @@ class Database:
         ip_address = results[0][0]
         self.cur.execute(f"UPDATE visitor SET ip_range_id = '{self.get_ip_range_id(ip_address)}' WHERE visitor_id = '{visitor_id}'")
 
+    def update_ip_range_ids(self):
+        """
+        update the ip_range_id column of all visitors
+        """
+        visitor_ids, ip_addresses = [], []
+        for visitor_id, ip_address in self("SELECT visitor_id, ip_address FROM visitor"):
+            visitor_ids.append(visitor_id)
+            ip_addresses.append(ip_address)
+        ip_range_ids = self.get_ip_range_ids(ip_addresses)
+        self.cur.executemany("UPDATE visitor SET ip_range_id = ? WHERE visitor_id = ?", zip(ip_range_ids, visitor_ids))
+        self.conn.commit()
+
 
 
     def get_country_id(self, name, code) -> int:
@@ -317,6 +735,9 @@ class Database:
         """
         update the geoip data with the contents of the geoip_city_csv file
 
+        The country, region and city ids are assigned in memory and the ip ranges are written to a staging table.
+        The staging table then replaces ip_range, everything happens in a single transaction.
+
         Make sure to update the visitor.ip_range_id column for all visitors.
         In case something changed, they might point to a different city.
         """
@@ -334,73 +755,90 @@ class Database:
                 f_gen = _count_generator(file.raw.read)
                 return sum( buf.count(b'\n') for buf in f_gen )
 
-        pmessage(f"Recreating the GeoIP database from {geoip_city_csv_path}. This might take a long time...")
+        pmessage(f"Recreating the GeoIP database from {geoip_city_csv_path}. This might take a while...")
         row_count = rawgencount(geoip_city_csv_path)
         pmessage(f"Total rows: {row_count}")
-
-        with open(geoip_city_csv_path, 'r') as file:
-            csv = reader(file, delimiter=',', quotechar='"')
-            file.seek(0)
-            # execute only if file could be opened
-            # delete all previous data
-            self.cur.execute(f"DELETE FROM ip_range")
-            self.cur.execute(f"DELETE FROM city")
-            self.cur.execute(f"DELETE FROM country")
-            self.cur.execute(f"DELETE FROM region")
-            self.conn.commit()
-            self.cur.execute(f"VACUUM")
-
-            # guarantees that unkown city/country will have id 0
-            self.cur.execute(f"INSERT INTO country (country_id, name, code) VALUES (0, 'Unknown', 'XX') ")
-            self.cur.execute(f"INSERT INTO region  (region_id, name, country_id) VALUES (0, 'Unknown', 0) ")
-            self.cur.execute(f"INSERT INTO city (city_id, name, region_id, country_id) VALUES (0, 'Unknown', 0, 0) ")
-
-            # for combining city ranges into a 'City in <Country>' range
-            # country_id for the range that was last added (for combining multiple csv rows in one ip_range)
+        progress_step = max(1, row_count // 100)
+
+        get_all = "all" in settings["data-collection"]["get_cities_for_countries"]
+
+        # guarantees that unkown city/country will have id 0
+        countries: dict[str, tuple[int, str]] = { "Unknown": (0, "XX") }  # name: (country_id, code)
+        regions: dict[tuple[str, int], int] = { ("Unknown", 0): 0 }  # (name, country_id): region_id
+        cities: dict[tuple[str, int, int], int] = { ("Unknown", 0, 0): 0 }  # (name, region_id, country_id): city_id
+
+        def get_ids(row) -> int:
+            """get the city_id for the csv row, add the country, region and city if needed"""
+            if row[COUNTRY] == "United Kingdom of Great Britain and Northern Ireland":
+                row[COUNTRY] = "United Kingdom"
+            if row[COUNTRY] not in countries:
+                countries[row[COUNTRY]] = (len(countries), row[CODE])
+            country_id = countries[row[COUNTRY]][0]
+            # only add cities for countries the user is interested in
+            if get_all or row[CODE] in settings["data-collection"]["get_cities_for_countries"]:
+                region, city = row[REGION], row[CITY]
+            else:
+                region, city = f"Region in {row[COUNTRY]}", f"City in {row[COUNTRY]}"
+            region_id = regions.setdefault((region, country_id), len(regions))
+            return cities.setdefault((city, region_id, country_id), len(cities))
+
+        def get_ranges(csv):
+            """
+            yield (low, high, city_id)
+            consecutive rows of the same city are combined into one range
+            """
             RANGE_DONE = -1
             combine_range_city_id = RANGE_DONE
             combine_range_low = RANGE_DONE
             combine_range_high = RANGE_DONE
-
-            get_all = "all" in settings["data-collection"]["get_cities_for_countries"]
-
-            def add_range(low, high, city_id):
-                pdebug(f"update_ip_range_id: Adding range for city={city_id:20}, low={low:16}, high={high:16}", lvl=3)
-                self.cur.execute(f"INSERT INTO ip_range (low, high, city_id) VALUES ({low}, {high}, {city_id})")
             for i, row in enumerate(csv, 1):
-                # if i % 100 == 0:
-                pmessage(f"Updating GeoIP database: {i:7}/{row_count} ({100.0*i/row_count:.2f}%)", end="\r")
-                # these might contain problematic characters (')
-                # row[CITY] = sanitize(row[CITY])
-                if row[COUNTRY] == "United Kingdom of Great Britain and Northern Ireland":
-                    row[COUNTRY] = "United Kingdom"
-                # row[COUNTRY] = sanitize(row[COUNTRY])
-                # row[REGION] = sanitize(row[REGION])
-
-                # make sure country exists
-                country_id = self.get_country_id(row[COUNTRY], row[CODE])
-                # only add cities for countries the user is interested in
-                if get_all or row[CODE] in settings["data-collection"]["get_cities_for_countries"]:
-                    region_id = self.get_region_id(row[REGION], country_id)
-                    city_id = self.get_city_id(row[CITY], region_id, country_id)
-                else:
-                    region_id = self.get_region_id(f"Region in {row[COUNTRY]}", country_id)
-                    city_id = self.get_city_id(f"City in {row[COUNTRY]}", region_id, country_id)
-                # if continuing 
+                if i % progress_step == 0:
+                    pmessage(f"Updating GeoIP database: {i:7}/{row_count} ({100.0*i/row_count:.2f}%)", end="\r")
+                city_id = get_ids(row)
+                if combine_range_city_id == city_id:
+                    # continuing previous range, extend the upper range limit
+                    combine_range_high = int(row[TO])
+                    continue
                 if combine_range_city_id != RANGE_DONE:
-                    # if continuing previous range, extend the upper range limit
-                    if combine_range_city_id == city_id:
-                        combine_range_high = row[TO]
-                    else:  # new range for city, append
-                        add_range(combine_range_low, combine_range_high, combine_range_city_id)
-                        combine_range_city_id = RANGE_DONE
-                # not elif, this has to be executed if previous else was executed
-                if combine_range_city_id == RANGE_DONE :  # currently in new range, combine with later ranges
-                    combine_range_city_id = city_id
-                    combine_range_low = row[FROM]
-                    combine_range_high = row[TO]
+                    pdebug(f"update_geoip_tables: Adding range for city={combine_range_city_id:20}, low={combine_range_low:16}, high={combine_range_high:16}", lvl=4)
+                    yield combine_range_low, combine_range_high, combine_range_city_id
+                combine_range_city_id = city_id
+                combine_range_low = int(row[FROM])
+                combine_range_high = int(row[TO])
             if combine_range_city_id != RANGE_DONE:  # last range , append
-                add_range(combine_range_low, combine_range_high, combine_range_city_id)
+                yield combine_range_low, combine_range_high, combine_range_city_id
+            pmessage(f"Updating GeoIP database: {row_count}/{row_count} (100.00%)")
+
+        with open(geoip_city_csv_path, 'r') as file:
+            csv = reader(file, delimiter=',', quotechar='"')
+            # execute only if file could be opened
+            self.conn.commit()
+            self.cur.execute("BEGIN")
+            try:
+                # staging table with the same definition as ip_range
+                self.cur.execute("DROP TABLE IF EXISTS ip_range_new")
+                create_ip_range = self("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'ip_range'")[0][0]
+                self.cur.execute(re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?ip_range"?', "CREATE TABLE ip_range_new", create_ip_range))
+                self.cur.executemany("INSERT INTO ip_range_new (low, high, city_id) VALUES (?, ?, ?)", get_ranges(csv))
+
+                self.cur.execute("DELETE FROM city")
+                self.cur.execute("DELETE FROM region")
+                self.cur.execute("DELETE FROM country")
+                self.cur.executemany("INSERT INTO country (country_id, name, code) VALUES (?, ?, ?)", ((country_id, name, code) for name, (country_id, code) in countries.items()))
+                self.cur.executemany("INSERT INTO region (region_id, name, country_id) VALUES (?, ?, ?)", ((region_id, *key) for key, region_id in regions.items()))
+                self.cur.executemany("INSERT INTO city (city_id, name, region_id, country_id) VALUES (?, ?, ?, ?)", ((city_id, *key) for key, city_id in cities.items()))
+
+                self.cur.execute("DROP TABLE ip_range")
+                self.cur.execute("ALTER TABLE ip_range_new RENAME TO ip_range")
+                self.conn.commit()
+            except:
+                self.conn.rollback()
+                raise
+        # recreate the indexes of ip_range
+        self.create_tables()
+        self.id_caches.pop("city", None)
+        self.ip_range_index = None
+        pmessage(f"Added {len(countries)} countries, {len(regions)} regions, {len(cities)} cities and {sql_tablesize(self.cur, 'ip_range')} ip ranges")
 
 
     #
@@ -1,5 +1,5 @@
 from sys import exit
-from os import path
+from os import path, cpu_count
 
 try:
     import sqlite3
@@ -16,10 +16,10 @@ if __name__ == "__main__":  # make relative imports work as described here: http
         filepath = path.realpath(path.abspath(__file__))
         sys.path.insert(0, path.dirname(path.dirname(filepath)))
 
-from .data_collection.parse_log import parse_log
+from .data_collection.parse_log import parse_log, parse_byte_ranges, parse_logfiles, get_log_format, get_logfile_paths, get_compression
+from .data_collection.log_reader import LogReader
 from .database import Database
-from .data_visualization.visualize import visualize
-from .utility.globals import settings, version, config_dir, data_dir
+from .utility.globals import settings, get_version, config_dir, data_dir
 from .utility.utility import pmessage, pdebug, make_parent_dirs
 
 """
@@ -32,8 +32,13 @@ def help():
     --config <path>             path to a config file that specifies all the other parameters: param = value, where value has the same formatting as on the command line
     --update-geoip <path>       path to IP-COUNTRY-REGION-CITY database in csv format
     --visualize                 generate the visualization website
-    --collect                   fill the database from the nginx access log
+    --collect [<path> ...]      fill the database from the nginx access log or from the given logfiles, which may be glob patterns and compressed
+    --follow                    keep running and add new lines of the nginx access log to the database as they are written
+    --syslog [<address>]        keep running and add the requests that nginx sends via syslog to the database
     --log-file <path>           use alternate logfile
+    --jobs <n>                  number of processes that parse the logfile
+    --explain                   print the query plan of every query
+    --version                   print the version of regina
     """
     print(helpstring)
 
@@ -54,12 +59,21 @@ def main():
     parser.add_argument("--config", "-c",   action="store",         help="path to an alternate config file", metavar="config-file")
     parser.add_argument("--update-geoip",   action="store",         help="path to IP-COUNTRY-REGION-CITY database in csv format", metavar="geoip-csv")
     parser.add_argument("--visualize",      action="store_true",    help="generate the visualization website")
-    parser.add_argument("--collect",        action="store_true",    help="fill the database from the nginx access log")
+    parser.add_argument("--collect",        action="store", nargs="*", help="fill the database from the nginx access log, or from the given logfiles. Glob patterns and gzip, bzip2 or xz compressed logfiles are supported", metavar="logfile")
+    parser.add_argument("--follow",         action="store_true",    help="keep running and add new lines of the nginx access log to the database as they are written")
+    parser.add_argument("--syslog",         action="store", nargs="?", const="", help="keep running and add the requests that nginx sends via syslog to the database. The address (unix:/path/to/socket or host:port) overrides the syslog_server from the config file", metavar="address")
     parser.add_argument("--log-file",       action="store",         help="use alternate logfile than what is set in the config file", metavar="log-file")
+    parser.add_argument("--jobs", "-j",     action="store", type=int, help="number of processes that parse the logfile, 0 means one per cpu. Overrides the jobs from the config file", metavar="n")
+    parser.add_argument("--explain",        action="store_true",    help="print the EXPLAIN QUERY PLAN of every database query and list the queries that scan whole tables")
+    parser.add_argument("--version",        action="store_true",    help="print the version of regina")
     args = parser.parse_args()
 
-    if not (args.collect or args.visualize or args.update_geoip):
-        parser.error("at least one of --visualize, --collect, or --update-geoip is required.")
+    if args.version:
+        print(f"regina {get_version()}")
+        exit(0)
+
+    if not (args.collect is not None or args.follow or args.syslog is not None or args.visualize or args.update_geoip):
+        parser.error("at least one of --visualize, --collect, --follow, --syslog or --update-geoip is required.")
 
     if args.config:
         if not path.isfile(args.config):
@@ -79,10 +93,13 @@ def main():
         error(f"key error while loading the configuration in '{config_path}':\n\t{e}")
     except Exception as e:
         error(f"while loading the configuration in '{config_path}':\n\t{e}")
-    settings.set("regina", "version", version, allow_new=True)
 
     if args.log_file:
         settings.set("regina", "access_log", args.log_file)
+    if args.jobs is not None:
+        settings.set("data-collection", "jobs", args.jobs)
+    if args.syslog:
+        settings.set("data-collection", "syslog_server", args.syslog)
 
     pdebug(f"Settings:\n{settings}", lvl=1)
 
@@ -91,28 +108,103 @@ def main():
     db_path = settings["regina"]["database"]
     make_parent_dirs(db_path)
     db = Database(db_path)
+    if args.explain:
+        db.explain_queries()
     # if not isfile(settings["db"]):
     #     create_db(settings["db"], settings["filegroups"], settings["locs_and_dirs"], settings["auto_group_filetypes"])
 
-    pmessage(f"regina version='{version}': server-name='{settings['regina']['server_name']}', database='{db_path}'")
+    pmessage(f"regina: server-name='{settings['regina']['server_name']}', database='{db_path}'")
     if args.update_geoip:
         if not path.isfile(args.update_geoip):
             parser.error(f"invalid path to GeoIP database: '{args.update_geoip}'")
         db.update_geoip_tables(args.update_geoip)
         # update visitors
-        for visitor_id,  in db(f"SELECT visitor_id FROM visitor"):
-            db.update_ip_range_id(visitor_id)
-
-    if args.collect:
-        requests = parse_log(settings['regina']["access_log"])
-        request_count, visitors_count, new_visitors_count = db.add_requests(requests)
+        db.update_ip_range_ids()
+
+    if args.collect is not None:
+        try:
+            get_log_format()
+        except ValueError as e:
+            error(f"invalid log_format in '{config_path}':\n\t{e}")
+        jobs = settings["data-collection"]["jobs"]
+        if jobs == 0: jobs = cpu_count() or 1
+        if args.collect:
+            # logfiles from the command line are always read completely
+            try:
+                logfile_paths = get_logfile_paths(args.collect)
+            except FileNotFoundError as e:
+                error(e)
+            try:
+                request_count, visitors_count, new_visitors_count = db.add_request_batches(parse_logfiles(logfile_paths, jobs))
+            except ValueError as e:
+                error(e)
+            logfiles_str = ", ".join(f"'{logfile_path}'" for logfile_path in logfile_paths)
+        else:
+            logfile_path = settings['regina']["access_log"]
+            log_reader = None
+            # the checkpoint stores a byte offset, which can not be used for compressed files
+            if settings["data-collection"]["log_checkpoint"] and get_compression(logfile_path) is None:
+                log_reader = LogReader(logfile_path, db.get_log_checkpoint(logfile_path))
+            if log_reader:
+                byte_ranges = log_reader.byte_ranges()
+                # the checkpoint after each byte range is stored with its requests, so that an interrupted run does not read them again
+                # if a byte range can not be parsed, the collection stops before its checkpoint is stored
+                try:
+                    request_count, visitors_count, new_visitors_count = db.add_request_batches(parse_byte_ranges([ byte_range for byte_range, _ in byte_ranges ], jobs),
+                                                                                               log_checkpoints=((logfile_path, checkpoint) for _, checkpoint in byte_ranges))
+                except ValueError as e:
+                    error(e)
+                db.set_log_checkpoint(logfile_path, log_reader.get_checkpoint())
+            elif jobs > 1:
+                try:
+                    request_count, visitors_count, new_visitors_count = db.add_request_batches(parse_logfiles([logfile_path], jobs))
+                except ValueError as e:
+                    error(e)
+            else:
+                request_count, visitors_count, new_visitors_count = db.add_requests(parse_log(logfile_path))
+            logfiles_str = f"'{logfile_path}'"
         if visitors_count > 0: percentage = 100.0*new_visitors_count/visitors_count
         else: percentage = 0.0
-        pmessage(f"-> from logfile '{settings['regina']['access_log']}':\n\t+ {request_count} new requests\n\t+ {visitors_count} total visitors\n\t+ {new_visitors_count} new visitors ({percentage:.2f}%)")
+        pmessage(f"-> from logfile {logfiles_str}:\n\t+ {request_count} new requests\n\t+ {visitors_count} total visitors\n\t+ {new_visitors_count} new visitors ({percentage:.2f}%)")
+
+    if args.follow:
+        try:
+            get_log_format()
+        except ValueError as e:
+            error(f"invalid log_format in '{config_path}':\n\t{e}")
+        logfile_path = settings['regina']["access_log"]
+        if get_compression(logfile_path) is not None:
+            error(f"can not follow compressed logfile '{logfile_path}'")
+        from .data_collection.follow import follow
+        try:
+            request_count = follow(db, logfile_path)
+        except ValueError as e:
+            error(e)
+        pmessage(f"-> stopped following logfile '{logfile_path}':\n\t+ {request_count} new requests")
+
+    if args.syslog is not None:
+        try:
+            get_log_format()
+        except ValueError as e:
+            error(f"invalid log_format in '{config_path}':\n\t{e}")
+        # imported here because asyncio is only needed for --syslog
+        from .data_collection.syslog_server import run_syslog_server, parse_syslog_address
+        address = settings["data-collection"]["syslog_server"]
+        try:
+            parse_syslog_address(address)
+        except ValueError as e:
+            error(e)
+        request_count = run_syslog_server(db, address)
+        pmessage(f"-> stopped listening on '{address}':\n\t+ {request_count} new requests")
 
     if args.visualize:
         # pmessage(f"regina version {version} with server-name '{settings['regina']['server_name']}', database '{db_path}'")
+        # imported here because importing matplotlib takes long, which is not needed for the data collection
+        from .data_visualization.visualize import visualize
         visualize(db)
 
+    if args.explain:
+        pmessage(db.query_explainer.summary())
+
 if __name__ == '__main__':
     main()
@@ -78,8 +78,62 @@ CREATE TABLE IF NOT EXISTS country(
     code        TEXT UNIQUE
 ) STRICT;
 
+
+-- COLLECTION
+-- position up to which a logfile has been collected
+CREATE TABLE IF NOT EXISTS log_checkpoint(
+    path            TEXT PRIMARY KEY,
+    inode           INTEGER,
+    device          INTEGER,
+    offset          INTEGER,
+    last_line_hash  TEXT
+) STRICT;
+
+-- ROLLUPS
+-- daily aggregates of the request table, maintained by Database.add_requests
+-- date is the local date in yyyy-mm-dd format
+CREATE TABLE IF NOT EXISTS visitor_day(
+    date            TEXT,
+    visitor_id      INTEGER,
+    request_count   INTEGER,
+    PRIMARY KEY(date, visitor_id),
+    FOREIGN KEY(visitor_id) REFERENCES visitor(visitor_id)
+) STRICT, WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS route_day(
+    date            TEXT,
+    route_id        INTEGER,
+    status          INTEGER,
+    request_count   INTEGER,
+    PRIMARY KEY(date, route_id, status),
+    FOREIGN KEY(route_id) REFERENCES route(route_id)
+) STRICT, WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS referer_day(
+    date            TEXT,
+    referer_id      INTEGER,
+    request_count   INTEGER,
+    PRIMARY KEY(date, referer_id),
+    FOREIGN KEY(referer_id) REFERENCES referer(referer_id)
+) STRICT, WITHOUT ROWID;
+
+-- index for finding the first day of a visitor
+CREATE INDEX IF NOT EXISTS visitor_day_visitor_idx ON visitor_day(visitor_id, date);
+-- index for the routes that had a successful request (route_ignore_404)
+CREATE INDEX IF NOT EXISTS route_day_status_idx ON route_day(status, route_id);
+
+-- index for looking up visitors during the collection
+CREATE INDEX IF NOT EXISTS visitors_ip_browser_platform_idx ON visitor(ip_address, browser_id, platform_id);
+
 -- indexes for rankings
-CREATE INDEX visitors_human_idx ON visitor(is_human);
-CREATE INDEX visitors_ip_range_idx ON visitor(ip_range_id);
-CREATE INDEX visitors_ip_range_human_idx ON visitor(is_human, ip_range_id);
-CREATE INDEX requests_visitor_time_idx ON request(visitor_id, time);
+CREATE INDEX IF NOT EXISTS visitors_human_idx ON visitor(is_human);
+CREATE INDEX IF NOT EXISTS visitors_ip_range_idx ON visitor(ip_range_id);
+CREATE INDEX IF NOT EXISTS visitors_ip_range_human_idx ON visitor(is_human, ip_range_id);
+CREATE INDEX IF NOT EXISTS requests_visitor_time_idx ON request(visitor_id, time);
+
+-- covering index for queries on time ranges of the request table, eg the first and last request or the data export
+CREATE INDEX IF NOT EXISTS requests_time_idx ON request(time, visitor_id, route_id, referer_id, status);
+
+-- the ip ranges are loaded in order with the index of UNIQUE(low), see Database._get_ip_range_index
+-- ip_range_low_high_idx was redundant to it, remove it from the databases that have it
+DROP INDEX IF EXISTS ip_range_low_high_idx;
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+"""
+Caches for the database
+"""
+
+class IdCache:
+    """
+    bidirectional name <-> id cache for a table with (table_id, name) columns
+    name can be any hashable, eg a tuple of columns that identify a row
+
+    if max_size is given, the least recently used entries are removed when the cache is full
+    if complete is True, all rows of the table are in the cache, so a name that is not cached is not in the table
+    """
+    def __init__(self, table: str, max_size: int|None=None):
+        self.table = table
+        self.max_size = max_size
+        self.name_to_id: OrderedDict[str, int] = OrderedDict()
+        self.id_to_name: dict[int, str] = {}
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.name_to_id)
+
+    def get_id(self, name: str) -> int|None:
+        id_ = self.name_to_id.get(name)
+        if id_ is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.max_size: self.name_to_id.move_to_end(name)
+        return id_
+
+    def get_name(self, id_: int) -> str|None:
+        name = self.id_to_name.get(id_)
+        if name is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            if self.max_size: self.name_to_id.move_to_end(name)
+        return name
+
+    def add(self, name: str, id_: int):
+        # remove the old mappings of name and id_, so that both directions stay consistent
+        old_id = self.name_to_id.pop(name, None)
+        if old_id is not None: del self.id_to_name[old_id]
+        old_name = self.id_to_name.pop(id_, None)
+        if old_name is not None: del self.name_to_id[old_name]
+        # inserted at the end, so it is the most recently used entry
+        self.name_to_id[name] = id_
+        self.id_to_name[id_] = name
+        if self.max_size and len(self.name_to_id) > self.max_size:
+            old_name, old_id = self.name_to_id.popitem(last=False)
+            del self.id_to_name[old_id]
+            self.complete = False
+
+    def clear(self):
+        self.name_to_id.clear()
+        self.id_to_name.clear()
+        self.complete = False
+
+    def __repr__(self):
+        return f"IdCache({self.table}): size={len(self)}, max_size={self.max_size}, complete={self.complete}, hits={self.hits}, misses={self.misses}"
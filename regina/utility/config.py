@@ -285,6 +285,13 @@ class ReginaSettings:
             raise KeyError(f"ReginaSettings: key '{key}' is unsupported in section '{section}'")
         self._settings[section][key] = value
 
+    def copy_from(self, other: "ReginaSettings"):
+        """
+        take over all values of other, eg the settings of the parent process in a worker process
+        """
+        self._settings = other._settings
+        self._types = other._types
+
     def __repr__(self):
         s = ""
         for section in self._settings.keys():
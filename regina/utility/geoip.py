@@ -0,0 +1,54 @@
+from array import array
+from bisect import bisect_right
+from typing import Iterable
+
+"""
+Fast lookups of ip ranges
+"""
+
+class IpRangeIndex:
+    """
+    Sorted, non-overlapping ip ranges for looking up the ip_range_id of an ip address in O(log n)
+
+    The ranges are stored in three parallel arrays of unsigned 64 bit integers,
+    which needs much less memory than a list of tuples.
+    """
+    def __init__(self, ranges: Iterable[tuple[int, int, int]]):
+        """
+        @param ranges: (low, high, ip_range_id), sorted by low
+        """
+        self.lows = array("Q")
+        self.highs = array("Q")
+        self.ids = array("Q")
+        for low, high, ip_range_id in ranges:
+            self.lows.append(low)
+            self.highs.append(high)
+            self.ids.append(ip_range_id)
+
+    def __len__(self):
+        return len(self.lows)
+
+    def get(self, ip_address: int) -> int:
+        """
+        @returns the ip_range_id of the range that contains ip_address or 0 if there is none
+        """
+        i = bisect_right(self.lows, ip_address) - 1
+        if i >= 0 and ip_address <= self.highs[i]:
+            return self.ids[i]
+        return 0
+
+    def get_many(self, ip_addresses: list[int]) -> list[int]:
+        """
+        get the ip_range_ids for many ip addresses at once
+        The ip addresses are sorted and merged with the ranges in a single pass,
+        the search for the next range only starts at the range of the previous ip address.
+        @returns list of ip_range_ids in the same order as ip_addresses (0 if there is no range)
+        """
+        ip_range_ids = [0] * len(ip_addresses)
+        lo = 0
+        for i in sorted(range(len(ip_addresses)), key=ip_addresses.__getitem__):
+            ip_address = ip_addresses[i]
+            lo = bisect_right(self.lows, ip_address, lo=lo)
+            if lo > 0 and ip_address <= self.highs[lo-1]:
+                ip_range_ids[i] = self.ids[lo-1]
+        return ip_range_ids
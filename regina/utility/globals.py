@@ -2,7 +2,6 @@
 
 import os
 import re
-import importlib.metadata
 
 if __name__ == "__main__":  # make relative imports work as described here: https://peps.python.org/pep-0366/#proposed-change
     if __package__ is None:
@@ -14,7 +13,13 @@ if __name__ == "__main__":  # make relative imports work as described here: http
 
 from regina.utility.config import CFG_Entry, CFG_File, ReginaSettings, Path, comment
 
-version = importlib.metadata.version("regina")
+def get_version() -> str:
+    """
+    get the version of the installed regina package
+    importlib.metadata is only imported here, since importing it takes longer than the rest of the startup
+    """
+    from importlib.metadata import version
+    return version("regina")
 
 # these oses and browser can be detected:
 # lower element takes precedence
@@ -80,6 +85,42 @@ cfg.add_section("regina", desc="", entries=[
             desc="path to the nginx access log to parse",
             typ_=Path(permissions="r"),
             exam="/var/log/nginx/access.log"),
+    CFG_Entry("log_format",
+            dflt="combined",
+            desc="log_format of the access log, as in the nginx configuration. combined is nginx' default format.\nThe variables $remote_addr, $time_local and $request (or $request_method, $request_uri and $server_protocol) are required,\n$status, $body_bytes_sent, $http_referer and $http_user_agent are used if present",
+            typ_=str,
+            exam="$remote_addr - $remote_user [$time_local] \"$request\" $status $body_bytes_sent \"$http_referer\" \"$http_user_agent\" $request_time $host"),
+    ])
+
+cfg.add_section("database", desc="SQLite settings that are applied whenever the database is opened. They do not affect the collected data.", entries=[
+    CFG_Entry("profile",
+            dflt="fast",
+            desc="set of PRAGMAs for the database connection:\n    fast: write-ahead log, synchronous=normal, 64 MiB page cache, 256 MiB memory map, temporary tables in memory\n    safe: write-ahead log, synchronous=full\n    sqlite: the defaults of sqlite\nWith the write-ahead log, --visualize can read while --collect writes. It does not work if the database is on a network file system.\nThe following settings override single PRAGMAs of the profile",
+            typ_="fast, safe or sqlite"),
+    CFG_Entry("journal_mode",
+            desc="PRAGMA journal_mode: delete, truncate, persist, memory, wal or off",
+            typ_=[str, None],
+            exam="wal"),
+    CFG_Entry("synchronous",
+            desc="PRAGMA synchronous: off, normal, full or extra",
+            typ_=[str, None],
+            exam="normal"),
+    CFG_Entry("cache_size",
+            desc="PRAGMA cache_size: number of pages, or the size in KiB if negative",
+            typ_=[int, None],
+            exam="-65536"),
+    CFG_Entry("mmap_size",
+            desc="PRAGMA mmap_size: maximum number of bytes of the database file that are memory-mapped",
+            typ_=[int, None],
+            exam="268435456"),
+    CFG_Entry("temp_store",
+            desc="PRAGMA temp_store: default, file or memory",
+            typ_=[str, None],
+            exam="memory"),
+    CFG_Entry("busy_timeout",
+            dflt=5000,
+            desc="number of milliseconds to wait if another regina process is writing to the database",
+            typ_=int),
     ])
 
 cfg.add_section("data-collection", desc="These settings affect the data collection. If changed, they will affect how the database is being filled in the future.", entries=[
@@ -99,6 +140,47 @@ cfg.add_section("data-collection", desc="These settings affect the data collecti
             dflt=0,
             desc="ignore requests from the same visitor to the same route if one was made within the last x seconds",
             typ_=int),
+    CFG_Entry("log_checkpoint",
+            dflt=True,
+            desc="whether to store how far the access log has been collected in the database and only collect new lines in the next run.\nRotated logs are detected if the rotated file is in the same directory (eg access.log.1)",
+            typ_=bool),
+    CFG_Entry("referer_route_cache_size",
+            dflt=100000,
+            desc="maximum number of referers and routes that are kept in memory during the collection. 0 means no limit",
+            typ_=int),
+    CFG_Entry("visitor_cache_size",
+            dflt=1000000,
+            desc="maximum number of visitors that are kept in memory during the collection. 0 means no limit",
+            typ_=int),
+    CFG_Entry("user_agent_cache_size",
+            dflt=10000,
+            desc="maximum number of user agents whose platform and browser are kept in memory during the collection. 0 means no limit",
+            typ_=int),
+    CFG_Entry("batch_size",
+            dflt=10000,
+            desc="number of requests that are parsed and added to the database at once. Larger batches are a bit faster, but need more memory",
+            typ_=int),
+    CFG_Entry("jobs",
+            dflt=1,
+            desc="number of processes that parse the access log. The requests are still added to the database by a single process. 0 means one process per cpu",
+            typ_=int),
+    CFG_Entry("follow_interval",
+            dflt=5.0,
+            desc="with --follow or --syslog: maximum number of seconds between a request being logged and it being added to the database. All requests logged within this time are added at once",
+            typ_=float),
+    CFG_Entry("follow_inotify",
+            dflt=True,
+            desc="with --follow: whether to use inotify to detect changes of the access log. If false or if inotify is not available, the access log is checked every follow_interval seconds",
+            typ_=bool),
+    CFG_Entry("syslog_server",
+            dflt="127.0.0.1:5140",
+            desc="with --syslog: address on which syslog messages from nginx are received, either unix:/path/to/socket for a unix datagram socket or host:port for udp.\nUse the same address in the nginx configuration: access_log syslog:server=<address>",
+            typ_=str,
+            exam="unix:/run/regina/syslog.sock"),
+    CFG_Entry("syslog_queue_size",
+            dflt=100000,
+            desc="with --syslog: maximum number of received lines that wait to be added to the database. When it is reached, no more messages are read from the socket until the queue is half empty",
+            typ_=int),
 
     CFG_Entry("delete_ip_addresses",  # TODO: Implement
             dflt=True,
@@ -140,6 +222,10 @@ cfg.add_section("data-visualization", desc="These settings affect the data visua
             desc="generate extra entry in visitor-request history for new visitors",
             dflt=True,
             typ_=bool),
+    CFG_Entry("render_cache",
+            desc="skip plots and exported data files whose data did not change since they were generated, so that their modification time stays the same. The hashes of the data are stored in the cache directory",
+            dflt=True,
+            typ_=bool),
     ])
 
 cfg.add_section("html-generation", desc="The template and generated file do actually have to be htmls, you can change it to whatever you want", entries=[
@@ -182,6 +268,14 @@ cfg.add_section("plot-generation", desc="Settings that affect the generated plot
             dflt=True,
             desc="add the height of the bar as label in bar plots",
             typ_=bool),
+    CFG_Entry("label_max_bars",
+            dflt=100,
+            desc="bar plots with more bars get no labels and ticks, since they would overlap. If None, all bar plots get labels",
+            typ_=[int, None]),
+    CFG_Entry("jobs",
+            dflt=0,
+            desc="number of processes that render the plots while the next statistics are queried from the database. 1 renders them one after another in the main process, 0 means one process per cpu",
+            typ_=int),
     ])
 
 cfg.add_section("data-export", desc="", entries=[
@@ -191,8 +285,8 @@ cfg.add_section("data-export", desc="", entries=[
             exam="/www/analytics/images"),
     CFG_Entry("filetype",
             dflt="csv",
-            desc="file extension for the exported data",
-            typ_="'csv' or 'pkl'"),
+            desc="file type of the exported data: csv, json lines, compressed numpy archive with one array per column or python pickle",
+            typ_="'csv', 'jsonl', 'npz' or 'pkl'"),
     ])
 
 cfg.add_section("rankings", desc="These options only apply if img_out_dir is not None", entries=[
@@ -287,6 +381,13 @@ cfg.add_section("debug", desc="", entries=[
 settings = ReginaSettings(cfg)
 # settings.load("generated-default.cfg")
 
+def init_worker_settings(parent_settings: ReginaSettings):
+    """
+    initializer for worker processes, use it as Pool(jobs, initializer=init_worker_settings, initargs=(settings,))
+    Only forked workers inherit the loaded settings, with the spawn or forkserver start method they would use the defaults.
+    """
+    settings.copy_from(parent_settings)
+
 def write_config():
     # export the configuration as generated-default.cfg
     with open("regina-default.cfg", "w") as file:
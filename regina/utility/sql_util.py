@@ -1,6 +1,12 @@
 import sqlite3 as sql
+from re import compile as re_compile
+
+from regina.utility.utility import pmessage
 """Various utilities"""
 
+# maximum number of ? parameters that are used in a single statement (SQLITE_MAX_VARIABLE_NUMBER is 999 in old sqlite versions)
+sql_max_variables = 500
+
 def get_date_constraint(at_date=None, min_date=None, max_date=None):
     """
     get a condition string that sets a condition on the time to a certain date
@@ -84,3 +90,68 @@ def sql_max(cur: sql.Cursor, table: str, column: str) -> int:
 def sql_get_count_where(cur: sql.Cursor, table, constraints) -> int:
     cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {sql_get_constaint_str(constraints)}")
     return cur.fetchone()[0]
+
+
+class QueryExplainer:
+    """
+    Print the EXPLAIN QUERY PLAN of every distinct query that is executed on a connection.
+    Use as trace callback: conn.set_trace_callback(QueryExplainer(database_path))
+    The plans are determined with a separate connection, since the traced connection must not be used in the callback.
+    Queries that only differ in their values are explained once.
+    """
+    re_literal = re_compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    explained_statements = ("SELECT", "WITH", "INSERT", "REPLACE", "UPDATE", "DELETE")
+
+    def __init__(self, database_path: str):
+        self.conn = sql.connect(f"file:{database_path}?mode=ro", uri=True)
+        # normalized query: [execution count, plan]
+        self.queries: dict[str, list] = {}
+
+    def __call__(self, statement: str):
+        query = " ".join(self.re_literal.sub("?", statement).split())
+        if not query.upper().startswith(self.explained_statements): return
+        if query in self.queries:
+            self.queries[query][0] += 1
+            return
+        try:
+            plan = self.conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        except sql.Error as e:
+            # eg tables that were created in the uncommitted transaction of the traced connection
+            plan = [(0, 0, 0, f"could not be explained: {e}")]
+        self.queries[query] = [1, plan]
+        pmessage(f"EXPLAIN QUERY PLAN {query}\n{self.format_plan(plan)}")
+
+    @staticmethod
+    def format_plan(plan: list[tuple[int, int, int, str]]) -> str:
+        depths = {0: 0}
+        s = ""
+        for id_, parent, _, detail in plan:
+            depths[id_] = depths.get(parent, 0) + 1
+            s += "    " * depths[id_] + detail + "\n"
+        return s.rstrip("\n")
+
+    @staticmethod
+    def get_full_scans(plan: list[tuple[int, int, int, str]]) -> list[str]:
+        """
+        get the plan steps that read a whole table without an index
+        scans of subqueries (MATERIALIZE x or CO-ROUTINE x) and constant rows are not counted
+        """
+        subqueries = { detail.split(" ")[1] for _, _, _, detail in plan if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")) }
+        full_scans = []
+        for _, _, _, detail in plan:
+            if not detail.startswith("SCAN ") or " USING " in detail: continue
+            name = detail.split(" ")[1]
+            if name in subqueries or name == "CONSTANT" or name.startswith("(subquery"): continue
+            full_scans.append(detail)
+        return full_scans
+
+    def summary(self) -> str:
+        full_scans = [ (query, count, self.get_full_scans(plan)) for query, (count, plan) in self.queries.items() ]
+        full_scans = [ (query, count, details) for query, count, details in full_scans if details ]
+        s = f"Explained {len(self.queries)} distinct queries, {sum(count for count, _ in self.queries.values())} executions. {len(full_scans)} queries scan a whole table"
+        for query, count, details in full_scans:
+            s += f"\n  ({count}x) {query}\n" + "\n".join(f"    {detail}" for detail in details)
+        return s
+
+    def close(self):
+        self.conn.close()
@@ -2,7 +2,9 @@
 # print(f"{__file__}: __name__={__name__}, __package__={__package__}, sys.path[0]={path[0]}")
 from sys import exit, stderr
 from os import path, makedirs
-from re import fullmatch, Pattern
+from re import fullmatch, Pattern, compile as re_compile
+from typing import Callable
+from itertools import islice
 
 from regina.utility.globals import settings
 
@@ -58,6 +60,38 @@ def is_blacklisted(val: str, blacklist: str|Pattern|None|list):
     return bl
 
 
+def get_filter(blacklist: str|Pattern|None|list, whitelist: str|Pattern|None|list) -> Callable[[str], bool]:
+    """
+    get a function that returns True if a value is not blacklisted and whitelisted
+    This does the same as is_blacklisted and is_whitelisted, but the regular expressions are compiled only once,
+    which makes it much faster for filtering many values.
+    """
+    def compile_list(regexp) -> list[Pattern]|None:
+        """None if everything should match"""
+        if not regexp: return None
+        if type(regexp) == list:
+            patterns = []
+            for r in regexp:
+                p = compile_list(r)
+                if p is None: return None
+                patterns += p
+            return patterns
+        if type(regexp) == Pattern:
+            if not regexp.pattern: return None
+            return [regexp]
+        if type(regexp) == str:
+            return [re_compile(regexp)]
+        warning(f"get_filter: Unsupported regexp type: {type(regexp)}")
+        return []
+    blacklist_patterns = compile_list(blacklist)
+    whitelist_patterns = compile_list(whitelist)
+    def filter_(val: str) -> bool:
+        if blacklist_patterns and any(p.fullmatch(val) for p in blacklist_patterns): return False
+        if whitelist_patterns is not None and not any(p.fullmatch(val) for p in whitelist_patterns): return False
+        return True
+    return filter_
+
+
 def pdebug(*args, lvl=2, **keys):
     if settings["debug"]["debug_level"] >= lvl: print(*args, **keys)
 
@@ -79,6 +113,13 @@ def dict_str(d: dict):
     return s.strip("\n")
 
 
+def batched(iterable, n: int):
+    """yield lists with at most n elements from iterable"""
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
 def get_filepath(filename, directories: list):
     """search directories for file and return the full path to the file"""
     for d in directories:
@@ -0,0 +1,47 @@
+"""
+Measure how fast parsed requests are added to the database with Database.add_request_batches.
+usage: python tests/bench_ingest.py [access.log]
+Without a logfile, 100000 generated lines in the combined format from 5000 ip addresses are used, see bench_parse_log.py.
+The requests are added to a new database with the default settings:
+    first half:         most visitors are new, the duplicate check in the database is skipped for their requests
+    second half:        most visitors exist, each of their requests is checked against the database with an EXISTS query
+    second half again:  all requests are duplicates
+"""
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from regina.database import Database
+from regina.data_collection.parse_log import parse_lines
+from regina.data_collection.request import RequestBatch
+from regina.utility.globals import settings
+from regina.utility.utility import batched
+
+from bench_parse_log import generate_lines
+
+def parse(lines: list[str]) -> list[RequestBatch]:
+    return [ RequestBatch(batch) for batch in batched(parse_lines(lines), settings["data-collection"]["batch_size"]) ]
+
+def bench(name: str, db: Database, batches: list[RequestBatch]):
+    line_count = sum(len(batch) for batch in batches)
+    start = perf_counter()
+    request_count, visitor_count, new_visitor_count = db.add_request_batches(batches)
+    duration = perf_counter() - start
+    print(f"{name:24}: {line_count / duration:9.0f} lines/s, {request_count} of {line_count} requests added, {new_visitor_count} of {visitor_count} visitors new")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", errors="replace") as file:
+            lines = file.read().splitlines()
+    else:
+        lines = generate_lines(100000, ip_count=5000)
+    start = perf_counter()
+    first_half, second_half = parse(lines[:len(lines) // 2]), parse(lines[len(lines) // 2:])
+    print(f"{'parse':24}: {len(lines) / (perf_counter() - start):9.0f} lines/s")
+    with TemporaryDirectory() as directory:
+        db = Database(path.join(directory, "bench.db"))
+        bench("first half", db, first_half)
+        bench("second half", db, second_half)
+        bench("second half again", db, second_half)
+        del db
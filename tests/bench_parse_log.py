@@ -0,0 +1,49 @@
+"""
+Compare the speed of the log_format parser with the regex that regina used before log_format existed.
+usage: python tests/bench_parse_log.py [access.log]
+Without a logfile, 100000 generated lines in the combined format are used.
+"""
+import sys
+from random import Random
+from re import match
+from time import perf_counter
+
+from regina.data_collection.log_format import LogFormat
+from regina.data_collection.parse_log import parse_line
+
+re_log_format_old = r'([0-9a-fA-F.:]+) - (.*) (\[.+\]) ("[^"]*") (\d+) (\d+) "([^"]*)" "([^"]*)"'
+
+def generate_lines(count: int, ip_count: int|None=None) -> list[str]:
+    """
+    generate count lines in the combined format, one per second
+    @param ip_count: number of different ip addresses, if None each line has a random ip address
+    """
+    random = Random(0)
+    def random_ip_address():
+        return f"10.{random.randrange(256)}.{random.randrange(256)}.{random.randrange(256)}"
+    ip_addresses = [ random_ip_address() for _ in range(ip_count) ] if ip_count else None
+    routes = ["/", "/index.html", "/img/logo.png", "/css/style.css", "/blog/2023/10/some-post.html", "/favicon.ico"]
+    user_agents = ["Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/118.0",
+                   "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+                   "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"]
+    return [ f'{random.choice(ip_addresses) if ip_addresses else random_ip_address()} - - [{10 + i // 86400:02}/Oct/2023:{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02} +0200] '
+             f'"GET {random.choice(routes)} HTTP/1.1" {random.choice([200, 200, 304, 404])} {random.randrange(100000)} "-" "{random.choice(user_agents)}"'
+             for i in range(count) ]
+
+def bench(name: str, function, lines: list[str]):
+    start = perf_counter()
+    matched = sum(1 for line in lines if function(line) is not None)
+    duration = perf_counter() - start
+    print(f"{name:24}: {len(lines) / duration:9.0f} lines/s, {matched} of {len(lines)} lines matched")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", errors="replace") as file:
+            lines = file.read().splitlines()
+    else:
+        lines = generate_lines(100000)
+    log_format = LogFormat("combined")
+    bench("old regex", lambda line: match(re_log_format_old, line), lines)
+    bench("LogFormat.split", log_format.split, lines)
+    bench("LogFormat.regex", log_format.regex.match, lines)
+    bench("parse_line", parse_line, lines)
@@ -0,0 +1,60 @@
+"""
+Compare the PRAGMA profiles of the database section of the config, see pragma_profiles in regina/database.py
+usage: python tests/bench_pragma_profiles.py [access.log]
+Without a logfile, 20000 generated lines in the combined format are used, see bench_parse_log.py.
+For each profile, the requests are added to a new database in a temporary directory:
+    batch_size=<n>:  with the default batch_size and with one commit per 100 requests, as with --follow or --syslog
+    reader:          while another connection holds a read transaction, as when --visualize runs during --collect
+"""
+import sqlite3
+import sys
+from os import path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from regina.database import Database, pragma_profiles
+from regina.data_collection.parse_log import parse_lines
+from regina.data_collection.request import RequestBatch
+from regina.utility.globals import settings
+from regina.utility.utility import batched
+
+from bench_parse_log import generate_lines
+
+def add_requests(database_path: str, batches: list[RequestBatch], hold_read_transaction=False) -> str:
+    db = Database(database_path)
+    reader = None
+    if hold_read_transaction:
+        reader = sqlite3.connect(database_path)
+        reader.execute("BEGIN")
+        reader.execute("SELECT COUNT(*) FROM request").fetchall()
+    line_count = sum(len(batch) for batch in batches)
+    start = perf_counter()
+    try:
+        db.add_request_batches(batches)
+        result = f"{line_count / (perf_counter() - start):9.0f} lines/s"
+    except sqlite3.OperationalError as e:
+        result = f"'{e}' after {perf_counter() - start:.2f} s"
+    finally:
+        if reader: reader.close()
+        del db
+    return result
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", errors="replace") as file:
+            lines = file.read().splitlines()
+    else:
+        lines = generate_lines(20000)
+    requests = list(parse_lines(lines))
+    default_batch_size = settings["data-collection"]["batch_size"]
+    settings.set("database", "busy_timeout", 2000)
+    with TemporaryDirectory() as directory:
+        for profile in pragma_profiles:
+            settings.set("database", "profile", profile)
+            for batch_size in [default_batch_size, 100]:
+                batches = [ RequestBatch(batch) for batch in batched(requests, batch_size) ]
+                settings.set("data-collection", "batch_size", batch_size)
+                print(f"{profile:8} batch_size={batch_size:<6}: {add_requests(path.join(directory, f'{profile}-{batch_size}.db'), batches)}")
+            settings.set("data-collection", "batch_size", default_batch_size)
+            batches = [ RequestBatch(batch) for batch in batched(requests, default_batch_size) ]
+            print(f"{profile:8} reader           : {add_requests(path.join(directory, f'{profile}-reader.db'), batches, hold_read_transaction=True)}")
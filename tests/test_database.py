@@ -0,0 +1,21 @@
+from os import path
+
+from regina.database import Database
+from regina.data_collection.request import RequestBatch, Request
+
+
+def make_batch(ip_address: int, route: str, time: int) -> RequestBatch:
+    return RequestBatch([Request.from_values(ip_address, time, "GET", route, "HTTP/1.1", "200", "0", "https://example.com/", "Mozilla/5.0 Firefox/118.0", None)])
+
+def test_concurrent_writers(tmp_path):
+    # eg --follow is running while --collect adds requests to the same database
+    database_path = str(tmp_path / "test.db")
+    db1 = Database(database_path)
+    db2 = Database(database_path)
+    # load the caches of db1, they contain all rows of the tables
+    db1.add_request_batches([make_batch(1, "/a", 1000)])
+    db2.add_request_batches([make_batch(2, "/b", 2000)])
+    # the visitor and the route from db2 are not in the caches of db1
+    assert db1.add_request_batches([make_batch(2, "/b", 3000)]) == (1, 1, 0)
+    assert db1.get_visitor_count() == 2
+    assert db1("SELECT COUNT(*) FROM route")[0][0] == 2
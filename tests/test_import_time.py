@@ -0,0 +1,40 @@
+import subprocess
+import sys
+from os import path
+
+"""
+regina.main is imported by every command, so it must not import the modules that only some commands need
+"""
+
+# seconds
+import_time_budget = 0.1
+# modules that take long to import and are imported when they are needed
+lazy_modules = ["matplotlib", "numpy", "importlib.metadata", "importlib.resources", "multiprocessing", "asyncio"]
+
+repo_dir = path.dirname(path.dirname(path.abspath(__file__)))
+
+def import_main() -> tuple[float, list[str]]:
+    """
+    import regina.main in a new interpreter
+    @returns import time, names of the lazy_modules that were imported
+    """
+    code = f"""
+import sys
+from time import perf_counter
+start = perf_counter()
+import regina.main
+print(perf_counter() - start)
+print(",".join(m for m in {lazy_modules!r} if m in sys.modules))
+"""
+    result = subprocess.run([sys.executable, "-c", code], cwd=repo_dir, capture_output=True, text=True, check=True)
+    duration, modules = result.stdout.splitlines()
+    return float(duration), [ m for m in modules.split(",") if m ]
+
+def test_lazy_imports():
+    _, modules = import_main()
+    assert modules == []
+
+def test_import_time():
+    # the fastest of a few runs, so that a busy machine does not make the test fail
+    duration = min(import_main()[0] for _ in range(5))
+    assert duration < import_time_budget
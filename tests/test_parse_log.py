@@ -0,0 +1,159 @@
+from calendar import timegm
+import multiprocessing
+from os import path
+
+import pytest
+
+from regina.utility.globals import settings
+from regina.data_collection.log_format import LogFormat, unquote_log_format, log_format_combined
+from regina.data_collection.parse_log import parse_line, parse_byte_ranges, split_byte_range, merge_request_batches, unmatched_range_min_lines
+from regina.data_collection.request import RequestBatch, Request, parse_time_local
+
+line_combined = '192.168.1.2 - - [10/Oct/2023:13:55:36 +0200] "GET /index.html HTTP/1.1" 200 1234 "https://example.com/" "Mozilla/5.0 (X11; Linux x86_64) Firefox/118.0"'
+
+
+@pytest.fixture(autouse=True)
+def combined_log_format():
+    settings.set("regina", "log_format", "combined")
+    yield
+    settings.set("regina", "log_format", "combined")
+
+
+#
+# LOG FORMAT
+#
+def test_unquote_log_format():
+    assert unquote_log_format("combined") == log_format_combined
+    assert unquote_log_format("""'$remote_addr [$time_local] '
+                                 '"$request" $status';""") == '$remote_addr [$time_local] "$request" $status'
+    assert unquote_log_format(' $remote_addr [$time_local] "$request"; ') == '$remote_addr [$time_local] "$request"'
+
+def test_log_format_requires_variables():
+    with pytest.raises(ValueError):
+        LogFormat("$remote_addr $request")
+    with pytest.raises(ValueError):
+        LogFormat("$remote_addr [$time_local]")
+
+def test_split_combined():
+    log_format = LogFormat("combined")
+    assert log_format.use_split
+    assert log_format.split(line_combined) == ["192.168.1.2", "-", "10/Oct/2023:13:55:36 +0200", "GET /index.html HTTP/1.1", "200", "1234",
+                                               "https://example.com/", "Mozilla/5.0 (X11; Linux x86_64) Firefox/118.0"]
+
+def test_split_ignores_trailing_fields():
+    log_format = LogFormat("combined")
+    values = log_format.split(line_combined + " 0.123 example.com")
+    assert values == log_format.split(line_combined)
+
+def test_split_quote_in_request():
+    # the fast path cuts the request at the first '" ', the regex has to find the right split
+    log_format = LogFormat("combined")
+    values = log_format.split('1.2.3.4 - - [10/Oct/2023:13:55:36 +0000] "GET /a "x" HTTP/1.1" 200 123 "-" "Mozilla/5.0"')
+    assert values[3] == 'GET /a "x" HTTP/1.1'
+    assert values[4:6] == ["200", "123"]
+
+def test_split_non_numeric_status():
+    log_format = LogFormat("combined")
+    assert log_format.split('1.2.3.4 - - [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" - 123 "-" "Mozilla/5.0"') is None
+    assert log_format.split("not a log line") is None
+
+def test_regex_without_separators():
+    log_format = LogFormat('$remote_addr [$time_local] "$request_method $request_uri $server_protocol" $status$request_time')
+    assert not log_format.use_split
+    values = log_format.split('1.2.3.4 [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/2.0" 2000.5')
+    assert values == ["1.2.3.4", "10/Oct/2023:13:55:36 +0000", "GET", "/a", "HTTP/2.0", "2000", ".5"]
+
+def test_request_and_extra_values():
+    log_format = LogFormat('$remote_addr [$time_local] "$request_method $request_uri $server_protocol" $host')
+    values = log_format.split('1.2.3.4 [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/2.0" example.com')
+    ip_address, time_local, request, method, uri, protocol, status, bytes_sent, referer, user_agent = log_format.get_request_values(values)
+    assert (ip_address, method, uri, protocol) == ("1.2.3.4", "GET", "/a", "HTTP/2.0")
+    assert request == status == bytes_sent == referer == user_agent == ""
+    assert log_format.get_extra_values(values) == { "host": "example.com" }
+
+
+#
+# PARSING
+#
+def test_parse_line():
+    request = parse_line(line_combined)
+    assert request is not None
+    assert (request.type, request.route, request.protocol, request.status, request.bytes_sent) == ("GET", "/index.html", "HTTP/1.1", "200", "1234")
+    assert request.time_local == timegm((2023, 10, 10, 11, 55, 36))
+
+def test_parse_line_invalid_status():
+    settings.set("regina", "log_format", '$remote_addr [$time_local] "$request" $status $upstream_status')
+    assert parse_line('1.2.3.4 [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" 99999 -') is None
+    settings.set("regina", "log_format", '$remote_addr [$time_local] "$request" $upstream_status')
+    request = parse_line('1.2.3.4 [10/Oct/2023:13:55:36 +0000] "GET /a HTTP/1.1" -')
+    assert len(RequestBatch([request])) == 1
+
+@pytest.mark.parametrize("time_local, expected", [
+    ("10/Oct/2023:13:55:36 +0000", timegm((2023, 10, 10, 13, 55, 36))),
+    ("10/Oct/2023:13:55:36 +0200", timegm((2023, 10, 10, 11, 55, 36))),
+    ("10/Oct/2023:13:55:36 -0530", timegm((2023, 10, 10, 19, 25, 36))),
+    ("31/Dec/2023:23:59:59 -0100", timegm((2024, 1, 1, 0, 59, 59))),
+    # fallback to the regex
+    ("[10/Oct/2023:13:55:36 +0200]", timegm((2023, 10, 10, 11, 55, 36))),
+    ("1/Oct/2023:13:55:36 +02:00", timegm((2023, 10, 1, 11, 55, 36))),
+    ("not a time", 0),
+    ("10/Foo/2023:13:55:36 +0000", 0),
+])
+def test_parse_time_local(time_local, expected):
+    assert parse_time_local(time_local) == expected
+    # again from the minute cache
+    assert parse_time_local(time_local) == expected
+
+@pytest.fixture
+def spawn_start_method():
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    yield
+    multiprocessing.set_start_method(start_method, force=True)
+
+def test_parse_byte_ranges_spawn(tmp_path, spawn_start_method):
+    # spawned workers do not inherit the loaded settings, they would parse with the default log_format
+    settings.set("regina", "log_format", '$remote_addr [$time_local] "$request" $status $host')
+    logfile_path = str(tmp_path / "access.log")
+    with open(logfile_path, "w") as file:
+        file.writelines(f'1.2.3.{i} [10/Oct/2023:13:55:{i:02} +0000] "GET /{i} HTTP/1.1" 200 example.com\n' for i in range(20))
+    with open(logfile_path, "rb") as file:
+        byte_ranges = [ (logfile_path, start, end) for start, end in split_byte_range(file, 0, path.getsize(logfile_path), range_size=300) ]
+    assert len(byte_ranges) > 2
+    batches = list(parse_byte_ranges(byte_ranges, jobs=2))
+    assert [ route for batch in batches for route in batch.route ] == [ f"/{i}" for i in range(20) ]
+
+def test_parse_byte_range_unmatched(tmp_path):
+    # lines in another format than combined
+    logfile_path = str(tmp_path / "access.log")
+    with open(logfile_path, "w") as file:
+        file.writelines(f'1.2.3.4 [10/Oct/2023:13:55:{i:02} +0000] "GET /{i} HTTP/1.1" 200\n' for i in range(unmatched_range_min_lines))
+    with pytest.raises(ValueError):
+        list(parse_byte_ranges([ (logfile_path, 0, path.getsize(logfile_path)) ], jobs=1))
+    # a few unmatched lines do not stop the collection
+    with open(logfile_path, "rb") as file:
+        end = len(file.readline()) * (unmatched_range_min_lines - 1)
+    assert len(list(parse_byte_ranges([ (logfile_path, 0, end) ], jobs=1))[0]) == 0
+
+
+#
+# MERGING
+#
+def make_batch(times: list[int]) -> RequestBatch:
+    return RequestBatch(Request.from_values(1, t, "GET", f"/{t}", "HTTP/1.1", "200", "0", "", "", None) for t in times)
+
+def test_merge_request_batches():
+    # two overlapping logfiles, the second one starts at 15
+    batches = [
+        (make_batch([10, 12, 16]), 15),
+        (make_batch([18, 20]), 15),
+        (make_batch([15, 17, 19]), float("inf")),
+        (make_batch([21, 22]), float("inf")),
+    ]
+    merged = list(merge_request_batches(batches))
+    times = [ t for batch in merged for t in batch.time_local ]
+    assert times == [10, 12, 15, 16, 17, 18, 19, 20, 21, 22]
+    routes = [ r for batch in merged for r in batch.route ]
+    assert routes == [ f"/{t}" for t in times ]
+    # only the requests before the cutoff are yielded before the last logfile is parsed
+    assert list(merged[0].time_local) == [10, 12]
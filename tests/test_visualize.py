@@ -0,0 +1,36 @@
+import multiprocessing
+import struct
+
+import pytest
+
+from regina.utility.globals import settings
+from regina.data_visualization.visualize import PlotRenderer, RenderTask, plot_ranking
+
+
+@pytest.fixture
+def spawn_start_method():
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    yield
+    multiprocessing.set_start_method(start_method, force=True)
+
+def get_png_size(filename: str) -> tuple[int, int]:
+    with open(filename, "rb") as file:
+        header = file.read(24)
+    assert header.startswith(b"\x89PNG")
+    return struct.unpack(">II", header[16:24])
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_render_dpi(tmp_path, spawn_start_method, jobs):
+    # spawned workers do not inherit the loaded settings, they would render with the default dpi
+    dpi = settings["plot-generation"]["dpi"]
+    settings.set("plot-generation", "dpi", 30)
+    try:
+        filename = str(tmp_path / "ranking.png")
+        renderer = PlotRenderer(jobs)
+        renderer.render(RenderTask(filename, plot_ranking, { "ranking": [(1, "/a"), (2, "/b")], "figsize": (10, 5) }))
+        renderer.finish()
+    finally:
+        settings.set("plot-generation", "dpi", dpi)
+    width, height = get_png_size(filename)
+    assert width < 10 * 60 and height < 5 * 60